@@ -1,6 +1,16 @@
 
+import re
 import xml.etree.ElementTree as ET
 
+BOUNDS_PATTERN = re.compile(r'^\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]$')
+
+def parse_bounds(bounds):
+    # '[l,t][r,b]' -> (l, t, r, b), or None
+    match = BOUNDS_PATTERN.match(bounds)
+    if match is None:
+        return None
+    return tuple(map(int, match.groups()))
+
 def build_children_map(element):
     return {parent: list(parent) for parent in element.iter()}
 
@@ -33,6 +43,21 @@ def is_clickable_or_has_clickable_children(node):
             return True
     return False
 
+def build_node_flags(root):
+    # element -> (all_children_are_leaves, is_clickable_or_has_clickable_children),
+    # computed once per snapshot instead of re-scanning children per visit
+    flags = {}
+    for element in root.iter():
+        leaves = True
+        clickable = element.attrib.get('clickable', '') == "true"
+        for child in element:
+            if leaves and len(child) > 0:
+                leaves = False
+            if not clickable and child.attrib.get('clickable', '') == "true":
+                clickable = True
+        flags[element] = (leaves, clickable)
+    return flags
+
 def check_error_keywords(tree, package_name):
     keywords = ['error', 'has stopped', 'crash', 'has crashed']
     for element in tree.iter():
@@ -0,0 +1,224 @@
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+
+
+# cheapest first
+RESET_LEVELS = ('clear', 'snapshot', 'reinstall')
+
+ANDROID_SDK = os.environ.get('ANDROID_SDK_ROOT', os.path.expanduser("~/Library/Android/sdk"))
+
+_hash_cache = {}  # path -> (size, mtime, sha256)
+_package_cache = {}  # path -> (size, mtime, package name)
+_registry_lock = threading.Lock()
+
+
+def apk_sha256(path):
+    stat = os.stat(path)
+    cached = _hash_cache.get(path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _hash_cache[path] = (stat.st_size, stat.st_mtime, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def find_aapt():
+    for name in ('aapt', 'aapt2'):
+        path = shutil.which(name)
+        if path:
+            return path
+        # newest build-tools first
+        found = sorted(glob.glob(os.path.join(ANDROID_SDK, 'build-tools', '*', name)), reverse=True)
+        if found:
+            return found[0]
+    return None
+
+
+def apk_package_name(path):
+    """The package name in the APK's manifest (aapt dump badging), or None without aapt."""
+    stat = os.stat(path)
+    cached = _package_cache.get(path)
+    if cached and cached[:2] == (stat.st_size, stat.st_mtime):
+        return cached[2]
+    aapt = find_aapt()
+    if aapt is None:
+        return None
+    try:
+        result = subprocess.run([aapt, 'dump', 'badging', path], capture_output=True, text=True, timeout=60)
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    match = re.search(r"^package: name='([^']+)'", result.stdout, re.MULTILINE)
+    if not match:
+        return None
+    _package_cache[path] = (stat.st_size, stat.st_mtime, match.group(1))
+    return match.group(1)
+
+
+class AppResetter:
+    """
+    Puts an emulator back into a clean state for the next test, using the
+    cheapest level that can:
+      clear     - `pm clear` when the same APK (by sha256) is already installed
+      snapshot  - load the emulator snapshot saved right after this APK's
+                  first clean install
+      reinstall - uninstall and install, then save that snapshot
+    A failed level escalates to the next one. snapshots must be False on
+    read-only emulators (the pool's default), where a saved snapshot does
+    not persist; the snapshot level is skipped then. Installed APK hashes are kept
+    in registry_file per device, so unchanged APKs are never reinstalled.
+    Without a package name (most bug reports have none) it is read from
+    the APK with aapt, or else from what the install added to the device;
+    a reset that cannot name the app fails.
+    """
+
+    def __init__(self, device_port, adb_path='adb', registry_file=None, snapshots=True):
+        self.serial = f'emulator-{device_port}'
+        self.adb_path = adb_path
+        self.registry_file = registry_file or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'installed_apks.json')
+        self.snapshots = snapshots
+
+    def adb(self, *args, timeout=60):
+        return subprocess.run([self.adb_path, '-s', self.serial, *args],
+                              capture_output=True, text=True, timeout=timeout)
+
+    def load_registry(self):
+        if not os.path.exists(self.registry_file):
+            return {}
+        try:
+            with open(self.registry_file) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def installed_hash(self, package_name):
+        with _registry_lock:
+            return self.load_registry().get(self.serial, {}).get(package_name)
+
+    def record_install(self, package_name, sha):
+        with _registry_lock:
+            registry = self.load_registry()
+            registry.setdefault(self.serial, {})[package_name] = sha
+            with open(self.registry_file, 'w') as f:
+                json.dump(registry, f, indent=2)
+
+    def is_installed(self, package_name, sha):
+        if self.installed_hash(package_name) != sha:
+            return False
+        # the emulator may have been wiped since the registry was written
+        return self.adb('shell', 'pm', 'path', package_name, timeout=10).stdout.startswith('package:')
+
+    def snapshot_name(self, package_name, sha):
+        return f"rebl_{package_name}_{sha[:12]}"
+
+    def has_snapshot(self, name):
+        result = self.adb('emu', 'avd', 'snapshot', 'list', timeout=20)
+        return result.returncode == 0 and name in result.stdout
+
+    def save_snapshot(self, name):
+        result = self.adb('emu', 'avd', 'snapshot', 'save', name, timeout=120)
+        return result.returncode == 0 and 'KO' not in result.stdout
+
+    def load_snapshot(self, name):
+        result = self.adb('emu', 'avd', 'snapshot', 'load', name, timeout=120)
+        if result.returncode != 0 or 'KO' in result.stdout:
+            return False
+        self.adb('wait-for-device', timeout=60)
+        return True
+
+    def clear_data(self, package_name):
+        return 'Success' in self.adb('shell', 'pm', 'clear', package_name, timeout=30).stdout
+
+    def package_paths(self):
+        """package -> installed APK path; a reinstall moves the package to a new path."""
+        result = self.adb('shell', 'pm', 'list', 'packages', '-f', timeout=30)
+        paths = {}
+        for line in result.stdout.splitlines():
+            if line.startswith('package:') and '=' in line:
+                path, package = line[len('package:'):].strip().rsplit('=', 1)
+                paths[package] = path
+        return paths
+
+    def install(self, apk_path, package_name=None):
+        """Clean install; returns the installed package name, or None on failure."""
+        package_name = package_name or apk_package_name(apk_path)
+        before = None
+        if package_name:
+            # Uninstall existing version if present
+            self.adb('uninstall', package_name, timeout=30)
+        else:
+            before = self.package_paths()
+        result = self.adb('install', '-r', apk_path, timeout=60)
+        if result.returncode != 0:
+            print(f"✗ Installation failed: {result.stderr}")
+            return None
+        if before is not None:
+            after = self.package_paths()
+            changed = [package for package, path in after.items() if before.get(package) != path]
+            if len(changed) != 1:
+                print(f"✗ Could not tell which package {os.path.basename(apk_path)} installed "
+                      f"(changed: {', '.join(changed) or 'none'}); install aapt or add 'Package:' to the bug report")
+                return None
+            package_name = changed[0]
+            # installed over an old copy, keeping its data: start again from a clean one
+            if package_name in before:
+                self.adb('uninstall', package_name, timeout=30)
+                if self.adb('install', apk_path, timeout=60).returncode != 0:
+                    print(f"✗ Reinstalling {package_name} failed")
+                    return None
+        self.record_install(package_name, apk_sha256(apk_path))
+        return package_name
+
+    def launch(self, package_name):
+        self.adb('shell', 'monkey', '-p', package_name, '-c', 'android.intent.category.LAUNCHER', '1', timeout=30)
+
+    def reset(self, apk_path, package_name, min_level='clear'):
+        """
+        Returns (level used, seconds), or (None, seconds) if every level
+        failed. min_level skips the cheaper levels, e.g. 'snapshot' to also
+        roll back device-wide state.
+        """
+        start = time.monotonic()
+        sha = apk_sha256(apk_path)
+        package_name = package_name or apk_package_name(apk_path)
+        levels = RESET_LEVELS[RESET_LEVELS.index(min_level):]
+        # pm clear and the snapshot both need to know which app they reset;
+        # the reinstall finds out from the device
+        if not package_name:
+            levels = ('reinstall',)
+
+        used = None
+        for level in levels:
+            try:
+                if level == 'clear':
+                    ok = self.is_installed(package_name, sha) and self.clear_data(package_name)
+                elif level == 'snapshot':
+                    snapshot = self.snapshot_name(package_name, sha)
+                    ok = self.snapshots and self.has_snapshot(snapshot) and self.load_snapshot(snapshot)
+                    if ok:
+                        self.record_install(package_name, sha)
+                else:
+                    package_name = self.install(apk_path, package_name)
+                    ok = package_name is not None
+                    if ok and self.snapshots:
+                        self.save_snapshot(self.snapshot_name(package_name, sha))
+            except (subprocess.TimeoutExpired, OSError) as e:
+                print(f"  {level} reset failed: {e}")
+                ok = False
+            if ok:
+                used = level
+                break
+
+        if used:
+            self.launch(package_name)
+        return used, time.monotonic() - start
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Per-screen cost of the perception pipeline (parsing, operable-element
+extraction, the screen description) on recorded hierarchy dumps.
+
+    python3 benchmark_extraction.py [--repeat N] [--json out.json]
+                                    [--save-baseline base.json | --baseline base.json]
+                                    [dump ...]
+    python3 benchmark_extraction.py collect --device emulator-5554
+    python3 benchmark_extraction.py collect --tape session.tape.json.gz
+
+The corpus is the checked-in ./tmp dump plus benchmarks/dumps/*.xml. Only
+./tmp is checked in, so collect is a required first step: run it against a
+device or on the tapes of recorded sessions until the corpus holds at least
+--min-dumps screens (default 10), and keep the collected dumps next to any
+baseline made from them. Dumps named on the command line are benchmarked
+as given. For each dump it
+reports time (median of N), Python allocations (tracemalloc; lxml's own C
+allocations are not included) and output size in characters and tokens
+for every stage. With --baseline the run fails when a stage got slower
+than --max-regression or its output changed.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from collections import Counter, defaultdict
+import hierarchy
+from hierarchy import *
+from token_counter import count_tokens
+
+
+CORPUS_DIR = os.path.join('benchmarks', 'dumps')
+# packages present on every screen that never are the app under test
+SYSTEM_PACKAGES = ('com.android.systemui', 'com.google.android.apps.nexuslauncher',
+                   'com.android.launcher3', 'com.google.android.inputmethod.latin')
+
+
+def corpus_files(paths):
+    if paths:
+        return paths
+    files = ['tmp'] if os.path.exists('tmp') else []
+    if os.path.isdir(CORPUS_DIR):
+        files += sorted(os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR) if name.endswith('.xml'))
+    return files
+
+
+def dump_package(tree):
+    """The app a dump belongs to: its most common non-system package."""
+    packages = Counter(element.attrib.get('package', '') for element in tree.iter('node'))
+    for package, _ in packages.most_common():
+        if package and package not in SYSTEM_PACKAGES:
+            return package
+    return None
+
+
+def extract(tree, package_name):
+    info, attr_map = new_screen_info(), defaultdict(list)
+    get_operable_elements(tree.getroot(), package_name, build_parent_map(tree), info, attr_map)
+    return info, attr_map
+
+
+def stages(xml):
+    """(name, fn) for each stage; fn() returns the stage's output."""
+    tree = parse_hierarchy(xml)
+    package_name = dump_package(tree)
+    info, _ = extract(tree, package_name)
+    screen = {'xml': xml.decode('utf-8'), 'package': package_name, 'activity': f'{package_name}.Activity',
+              'orientation': 'natural', 'toast': None}
+    # imported here: fake_device pulls in the LLM client
+    from fake_device import FakeDevice
+
+    def sequential_info():
+        copy = {key: (set(value) if key == 'visited' else list(value)) for key, value in info.items()}
+        return get_sequential_info(copy, screen['activity'], 'natural', None)
+
+    return package_name, [
+        ('parse_hierarchy', lambda: parse_hierarchy(xml)),
+        ('get_operable_elements', lambda: extract(tree, package_name)[0]),
+        ('get_sequential_info', sequential_info),
+        ('check_error_keywords', lambda: check_error_keywords(tree, package_name)),
+        ('get_screen_information', lambda: get_screen_information(FakeDevice(screen), defaultdict(list), package_name)[1]),
+    ]
+
+
+def output_size(output):
+    if isinstance(output, str):
+        text = output
+    elif isinstance(output, dict):
+        text = json.dumps({k: v for k, v in output.items() if k != 'visited'}, default=str)
+    elif isinstance(output, bool):
+        text = str(output)
+    else:
+        return 0, 0
+    return len(text), count_tokens(text)
+
+
+def time_process_group_general(tree, package_name, repeat):
+    """Cumulative time spent in process_group_general during one extraction."""
+    original = hierarchy.process_group_general
+    spent = [0.0]
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            spent[0] += time.perf_counter() - start
+
+    samples = []
+    hierarchy.process_group_general = timed
+    try:
+        for _ in range(repeat):
+            spent[0] = 0.0
+            extract(tree, package_name)
+            samples.append(spent[0])
+    finally:
+        hierarchy.process_group_general = original
+    return sorted(samples)[len(samples) // 2]
+
+
+def measure(fn, repeat):
+    fn()  # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    chars, tokens = output_size(output)
+    return {
+        'median_ms': samples[len(samples) // 2] * 1000,
+        'min_ms': samples[0] * 1000,
+        'alloc_kb': max(after - before, 0) / 1024,
+        'peak_kb': max(peak - before, 0) / 1024,
+        'chars': chars,
+        'tokens': tokens,
+    }
+
+
+def benchmark_dump(path, repeat):
+    with open(path, 'rb') as f:
+        xml = f.read()
+    package_name, stage_list = stages(xml)
+    results = {name: measure(fn, repeat) for name, fn in stage_list}
+    tree = parse_hierarchy(xml)
+    results['process_group_general'] = {'median_ms': time_process_group_general(tree, package_name, repeat) * 1000}
+    info, _ = extract(tree, package_name)
+    return {'dump': path, 'package': package_name, 'nodes': sum(1 for _ in tree.iter('node')),
+            'groups': sum(len(v) for k, v in info.items() if k != 'visited'), 'stages': results}
+
+
+def compare(results, baseline, max_regression, min_delta_ms):
+    """Regressions against a saved run: slower stages and changed outputs."""
+    previous = {r['dump']: r for r in baseline.get('results', [])}
+    problems = []
+    for result in results:
+        old = previous.get(result['dump'])
+        if old is None:
+            continue
+        for stage, now in result['stages'].items():
+            before = old['stages'].get(stage)
+            if before is None:
+                continue
+            limit = max(before['median_ms'] * (1 + max_regression), before['median_ms'] + min_delta_ms)
+            if now['median_ms'] > limit:
+                problems.append(f"{result['dump']} {stage}: {now['median_ms']:.3f} ms > {limit:.3f} ms "
+                                f"(baseline {before['median_ms']:.3f} ms)")
+            if 'chars' in before and now.get('chars') != before['chars']:
+                problems.append(f"{result['dump']} {stage}: output changed, {before['chars']} -> {now.get('chars')} chars")
+    return problems
+
+
+def print_results(results):
+    # (nodes/groups) after each dump
+    print(f"{'Dump':<32} {'Stage':<24} {'Median ms':>10} {'Min ms':>8} {'Alloc KB':>9} {'Peak KB':>8} {'Chars':>7} {'Tokens':>7}")
+    for result in results:
+        name = f"{os.path.basename(result['dump'])} ({result['nodes']}/{result['groups']})"
+        for stage, r in result['stages'].items():
+            if 'min_ms' in r:
+                print(f"{name:<32} {stage:<24} {r['median_ms']:>10.3f} {r['min_ms']:>8.3f} {r['alloc_kb']:>9.1f} "
+                      f"{r['peak_kb']:>8.1f} {r['chars']:>7} {r['tokens']:>7}")
+            else:
+                print(f"{name:<32} {stage:<24} {r['median_ms']:>10.3f}")
+            name = ''
+
+
+def collect(args):
+    """Add dumps to the corpus from a device or from recorded session tapes."""
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    xmls = []
+    if args.device:
+        import uiautomator2 as u2
+        xmls.append(u2.connect(args.device).dump_hierarchy())
+    for path in args.tape or []:
+        from session_tape import SessionTape
+        tape = SessionTape.load(path)
+        for step in tape.steps:
+            xmls.append(step['screen']['xml'])
+            xmls.extend(c['screen_after']['xml'] for c in step['commands'] if c.get('screen_after'))
+    added = 0
+    for xml in xmls:
+        tree = parse_hierarchy(xml)
+        # one file per distinct screen
+        name = f"{dump_package(tree) or 'unknown'}_{hierarchy_fingerprint(tree)[:10]}.xml"
+        path = os.path.join(CORPUS_DIR, name)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(xml)
+            added += 1
+    print(f"Added {added} new dump(s) to {CORPUS_DIR} ({len(xmls) - added} already present)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'collect':
+        parser = argparse.ArgumentParser(description="Add hierarchy dumps to the benchmark corpus")
+        parser.add_argument('--device', help="dump the current screen of this device, e.g. emulator-5554")
+        parser.add_argument('--tape', action='append', help="every screen of a recorded session")
+        collect(parser.parse_args(sys.argv[2:]))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the perception pipeline")
+    parser.add_argument('dumps', nargs='*')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help="write the results here")
+    parser.add_argument('--save-baseline', help="write the results as a baseline")
+    parser.add_argument('--baseline', help="fail on regressions against this baseline")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="allowed slowdown per stage as a fraction (default 0.25)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.2,
+                        help="slowdowns below this many ms are noise (default 0.2)")
+    parser.add_argument('--min-dumps', type=int, default=10,
+                        help="fewest screens the collected corpus must hold (default 10)")
+    args = parser.parse_args()
+
+    files = corpus_files(args.dumps)
+    if not files or (not args.dumps and len(files) < args.min_dumps):
+        print(f"The corpus holds {len(files)} dump(s), fewer than --min-dumps {args.min_dumps}; "
+              f"a benchmark on so few screens is not representative. Collect more first:\n"
+              f"    python3 benchmark_extraction.py collect --device <serial>\n"
+              f"    python3 benchmark_extraction.py collect --tape <session.tape.json.gz>")
+        sys.exit(1)
+    results = [benchmark_dump(path, args.repeat) for path in files]
+    print_results(results)
+
+    report = {'repeat': args.repeat, 'python': sys.version.split()[0], 'results': results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved to: {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.max_regression, args.min_delta_ms)
+        if problems:
+            print(f"\n{len(problems)} regression(s) against {args.baseline}:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
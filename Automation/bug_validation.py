@@ -1,6 +1,7 @@
 
 
 from utils import  get_logcat
+from logcat_watcher import get_logcat_watcher
 from datetime import datetime
 
 
@@ -12,8 +13,12 @@ def log_and_save_history(reprot_file_name, start_time, response_time, total_comm
     
 
 def check_crash(device_port):
-    logcat = get_logcat(device_port)
-    if 'FATAL' in logcat:
+    watcher = get_logcat_watcher(device_port)
+    if watcher is not None and watcher.alive:
+        crashed = watcher.has_crash()
+    else:
+        crashed = 'FATAL' in get_logcat(device_port)
+    if crashed:
         print('Found fatal')
         return True
     return False
@@ -0,0 +1,79 @@
+import subprocess
+import threading
+
+
+def serial_to_port(serial):
+    # reproduction.py addresses devices as emulator-<port>
+    return serial[len('emulator-'):] if serial.startswith('emulator-') else serial
+
+def port_to_serial(port):
+    port = str(port)
+    return port if port.startswith('emulator-') else f'emulator-{port}'
+
+
+class DevicePool:
+    """
+    The emulators a batch may use. Each device runs one test at a time; a
+    device that drops off adb or keeps failing is quarantined and receives
+    no further tests.
+    """
+
+    def __init__(self, serials, adb_path='adb', max_failures=2):
+        self.serials = [port_to_serial(s) for s in serials]
+        self.adb_path = adb_path
+        self.max_failures = max_failures
+        self.failures = {serial: 0 for serial in self.serials}
+        self.quarantined = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def discover(adb_path='adb'):
+        """Serials of all emulators adb currently reports as online."""
+        result = subprocess.run([adb_path, 'devices'], capture_output=True, text=True, timeout=10)
+        serials = []
+        for line in result.stdout.splitlines()[1:]:
+            fields = line.split()
+            if len(fields) >= 2 and fields[1] == 'device' and fields[0].startswith('emulator-'):
+                serials.append(fields[0])
+        return serials
+
+    def is_online(self, serial):
+        try:
+            result = subprocess.run([self.adb_path, '-s', serial, 'get-state'],
+                                    capture_output=True, text=True, timeout=10)
+        except (subprocess.TimeoutExpired, OSError):
+            return False
+        return result.stdout.strip() == 'device'
+
+    def is_quarantined(self, serial):
+        with self._lock:
+            return serial in self.quarantined
+
+    def healthy(self):
+        with self._lock:
+            return [serial for serial in self.serials if serial not in self.quarantined]
+
+    def quarantine(self, serial, reason=''):
+        with self._lock:
+            self.quarantined.add(serial)
+        print(f"[{serial}] quarantined{': ' + reason if reason else ''}")
+
+    def report(self, serial, ok):
+        """
+        Record a test outcome. Returns False (and quarantines the device) when
+        the device is offline or has failed max_failures tests in a row.
+        """
+        if ok:
+            with self._lock:
+                self.failures[serial] = 0
+            return True
+        if not self.is_online(serial):
+            self.quarantine(serial, 'device is offline')
+            return False
+        with self._lock:
+            self.failures[serial] += 1
+            failures = self.failures[serial]
+        if failures >= self.max_failures:
+            self.quarantine(serial, f'{failures} consecutive failures')
+            return False
+        return True
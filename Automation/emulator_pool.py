@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Keeps a pool of booted emulators warm between batches.
+
+    python3 emulator_pool.py up 3 [--headless] [--avd NAME] [--writable]   # prints the ports
+    python3 emulator_pool.py status
+    python3 emulator_pool.py down
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from device_pool import *
+
+
+ANDROID_SDK = os.environ.get('ANDROID_SDK_ROOT', os.path.expanduser("~/Library/Android/sdk"))
+
+
+class EmulatorPool:
+    """
+    Boots AVDs from their quick-boot snapshot instead of cold, and treats a
+    device as ready once sys.boot_completed is set, not merely when adb lists
+    it. Emulators are started detached so they outlive the batch; the next
+    `up` reuses every emulator already running and only boots the shortfall.
+    """
+
+    def __init__(self, sdk_root=ANDROID_SDK, headless=False, boot_timeout=300):
+        self.adb_path = os.path.join(sdk_root, 'platform-tools', 'adb')
+        self.emulator_path = os.path.join(sdk_root, 'emulator', 'emulator')
+        self.headless = headless
+        self.boot_timeout = boot_timeout
+
+    def adb(self, serial, *args, timeout=10):
+        try:
+            return subprocess.run([self.adb_path, '-s', serial, *args],
+                                  capture_output=True, text=True, timeout=timeout).stdout.strip()
+        except (subprocess.TimeoutExpired, OSError):
+            return ''
+
+    def list_avds(self):
+        result = subprocess.run([self.emulator_path, '-list-avds'], capture_output=True, text=True, timeout=30)
+        return [line.strip() for line in result.stdout.splitlines() if line.strip() and not line.startswith('INFO')]
+
+    def running(self):
+        return DevicePool.discover(self.adb_path)
+
+    def is_booted(self, serial):
+        return self.adb(serial, 'shell', 'getprop', 'sys.boot_completed') == '1'
+
+    def free_ports(self, count):
+        used = {int(serial_to_port(serial)) for serial in self.running()}
+        # console ports are the even numbers from 5554 up to 5682
+        return [port for port in range(5554, 5684, 2) if port not in used][:count]
+
+    def boot(self, avd, port, read_only=True):
+        command = [self.emulator_path, '-avd', avd, '-port', str(port), '-no-boot-anim']
+        if self.headless:
+            command += ['-no-window', '-no-audio']
+        if read_only:
+            command.append('-read-only')
+        subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         stdin=subprocess.DEVNULL, start_new_session=True)
+        return port_to_serial(port)
+
+    def wait_for_boot(self, serial):
+        deadline = time.monotonic() + self.boot_timeout
+        interval = 0.5
+        while time.monotonic() < deadline:
+            if self.is_booted(serial):
+                return True
+            time.sleep(interval)
+            interval = min(interval * 1.5, 3)
+        return False
+
+    def up(self, count, avd=None, writable=False):
+        """
+        Serials of count booted emulators, booting only the missing ones.
+        New instances are read-only, so several can share an AVD and test
+        state never leaks into its quick-boot snapshot; writable boots one
+        instance per AVD so save_quickboot can refresh the snapshot.
+        """
+        # emulators still booting from an earlier call are waited for, not duplicated
+        ready = [serial for serial in self.running() if self.wait_for_boot(serial)]
+        missing = count - len(ready)
+        if missing > 0:
+            avds = [avd] if avd else self.list_avds()
+            if not avds:
+                raise RuntimeError("no AVDs available; create one in Android Studio")
+            if writable and missing > len(avds):
+                raise RuntimeError(f"{missing} writable emulators need as many AVDs, found {len(avds)}")
+            booting = [self.boot(avds[i % len(avds)], port, read_only=not writable)
+                       for i, port in enumerate(self.free_ports(missing))]
+            print(f"Booting {', '.join(booting)} from quick-boot snapshots...", file=sys.stderr)
+            with ThreadPoolExecutor(len(booting) or 1) as executor:
+                for serial, booted in zip(booting, executor.map(self.wait_for_boot, booting)):
+                    if booted:
+                        ready.append(serial)
+                    else:
+                        print(f"{serial} did not finish booting in {self.boot_timeout}s", file=sys.stderr)
+        return ready[:count]
+
+    def save_quickboot(self, serial):
+        """Save the running state as the AVD's quick-boot snapshot."""
+        return 'OK' in self.adb(serial, 'emu', 'avd', 'snapshot', 'save', 'default_boot', timeout=120)
+
+    def down(self, serials=None):
+        for serial in serials or self.running():
+            self.adb(serial, 'emu', 'kill')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a pool of warm emulators")
+    parser.add_argument('action', choices=('up', 'status', 'down'))
+    parser.add_argument('count', nargs='?', type=int, default=1, help="emulators wanted (up)")
+    parser.add_argument('--avd', help="AVD to boot (default: all AVDs, round robin)")
+    parser.add_argument('--headless', action='store_true', help="boot without a window")
+    parser.add_argument('--save-snapshot', action='store_true',
+                        help="after up, save each emulator's state as its quick-boot snapshot")
+    parser.add_argument('--writable', action='store_true',
+                        help="boot writable instances (one per AVD), e.g. for incremental_test.py --snapshots")
+    args = parser.parse_args()
+
+    pool = EmulatorPool(headless=args.headless)
+    if args.action == 'up':
+        start = time.monotonic()
+        serials = pool.up(args.count, args.avd, writable=args.save_snapshot or args.writable)
+        if args.save_snapshot:
+            for serial in serials:
+                pool.save_quickboot(serial)
+        print(f"{len(serials)} emulator(s) ready in {time.monotonic() - start:.1f}s", file=sys.stderr)
+        # ports on stdout, ready for incremental_test.py / reproduction.py
+        print(' '.join(serial_to_port(serial) for serial in serials))
+        sys.exit(0 if len(serials) == args.count else 1)
+    elif args.action == 'status':
+        for serial in pool.running():
+            print(f"{serial}\t{'booted' if pool.is_booted(serial) else 'booting'}")
+    else:
+        pool.down()
+
+
+if __name__ == "__main__":
+    main()
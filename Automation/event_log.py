@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import threading
+from session_state import *
+
+
+class EventLog:
+    """
+    JSON Lines record of one reproduction: prompts, LLM responses, parsed
+    commands, their execution, waits and crash checks. Each line carries a
+    sequence number, t (monotonic seconds since the log opened), the wall
+    clock time and, for timed steps, a duration. Lines are flushed as they
+    are written so a reader can follow the file while the run is going.
+    Without a path events are dropped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.start = time.monotonic()
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8')
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def emit(self, event, duration=None, **fields):
+        if self._file is None:
+            return
+        with self._lock:
+            self.seq += 1
+            entry = {'seq': self.seq, 'event': event,
+                     't': round(time.monotonic() - self.start, 4), 'wall': time.time()}
+            if duration is not None:
+                entry['duration'] = round(duration, 4)
+            entry.update(fields)
+            self._file.write(json.dumps(entry, default=str) + '\n')
+            self._file.flush()
+
+    def timed(self, event, **fields):
+        """with log.timed('llm_response') as info: ... emits when the block ends."""
+        return _TimedEvent(self, event, fields)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _TimedEvent:
+    def __init__(self, log, event, fields):
+        self.log = log
+        self.event = event
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.fields['error'] = str(exc)
+        self.log.emit(self.event, time.monotonic() - self.start, **self.fields)
+        return False
+
+
+def read_events(path):
+    """Yield events one line at a time; a torn last line is skipped."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class EventSummary:
+    """Per-test metrics folded from an event stream, one event at a time."""
+
+    def __init__(self):
+        self.gpt_responses = 0
+        self.total_commands = 0
+        self.bug_reproduced = False
+        self.timed_out = False
+        self.failure_reason = ''
+        self.finished = False
+        self.saved_round_trips = 0
+        self.seconds = {}
+
+    def add(self, event):
+        name = event.get('event')
+        if name == 'llm_response':
+            self.gpt_responses += 1
+        elif name == 'command':
+            self.total_commands += 1
+        elif name in ('commands', 'llm_stream_end') and event.get('saved'):
+            self.saved_round_trips += 1
+        elif name == 'error' and not self.failure_reason:
+            self.failure_reason = event.get('message', '')[:100]
+        elif name == 'result':
+            self.finished = True
+            self.bug_reproduced = bool(event.get('bug_reproduced'))
+            self.timed_out = bool(event.get('timed_out'))
+            # the loop's own counts: every parsed command, not just executed ones
+            self.gpt_responses = event.get('gpt_responses', self.gpt_responses)
+            self.total_commands = event.get('total_commands', self.total_commands)
+            self.failure_reason = event.get('failure_reason') or self.failure_reason
+        if 'duration' in event:
+            key = f"wait:{event.get('name')}" if name == 'wait' else name
+            self.seconds[key] = self.seconds.get(key, 0.0) + event['duration']
+        return self
+
+    def metrics(self):
+        return {
+            'total_commands': self.total_commands,
+            'gpt_responses': self.gpt_responses,
+            'bug_reproduced': self.bug_reproduced,
+            'failure_reason': self.failure_reason,
+            'saved_round_trips': self.saved_round_trips,
+            'log_file': '',
+        }
+
+
+class EventTail:
+    """
+    Follows an event stream while it is being written: each poll() folds
+    the lines completed since the last one into summary.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = b''
+        self.summary = EventSummary()
+        self.last_event = None
+
+    def poll(self):
+        if not os.path.exists(self.path):
+            return self.summary
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        # the last piece is a line still being written
+        self.partial = lines.pop()
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self.last_event = event
+            self.summary.add(event)
+        return self.summary
+
+
+def summarize_events(path):
+    summary = EventSummary()
+    if os.path.exists(path):
+        for event in read_events(path):
+            summary.add(event)
+    return summary
+
+
+_session_log = session_local(EventLog)
+
+def get_event_log():
+    return _session_log.get()
+
+def set_event_log(log):
+    return _session_log.set(log)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python3 event_log.py <events.jsonl> [...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        summary = summarize_events(path)
+        print(f"{path}: reproduced={summary.bug_reproduced} timed_out={summary.timed_out} "
+              f"responses={summary.gpt_responses} commands={summary.total_commands} "
+              f"saved_round_trips={summary.saved_round_trips}")
+        for name, seconds in sorted(summary.seconds.items(), key=lambda item: -item[1]):
+            print(f"  {name:<14} {seconds:>9.2f}s")
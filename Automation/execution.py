@@ -2,6 +2,7 @@
 import re
 import time
 from uiautomator2 import Direction
+from wait_policy import *
 
 
 
@@ -16,18 +17,21 @@ def swipe(device, direction):
      device.swipe_ext("right", scale=0.9) 
    
 
+@traced('restart')
 def restart(device, package_name):  
+    policy = get_wait_policy()
     device.app_stop(package_name) 
-    time.sleep(2)
+    policy.wait_for_app_stopped(device, package_name)
     device.app_start(package_name)
-    time.sleep(2)
+    policy.wait_for_app_foreground(device, package_name)
+    policy.wait_for_idle(device, 'restart')
 
 
 def click(device, coor):
     device.click(coor[0],coor[1])
 
 def long_click(device, coor):
-    device.long_click(coor[0],coor[1], 1.5)
+    device.long_click(coor[0],coor[1], get_wait_policy().long_press_duration)
 
 def set_text(device, rep_attr, list):
     ui_object = locate_ui_object(device, rep_attr)
@@ -56,7 +60,7 @@ def execute_suggestion(suggestion_list, attribute_to_element_map, device, packag
             attribute = suggestion[0]
             element = attribute_to_element_map.get(attribute)
             execute(device, element, suggestion)
-            time.sleep(3)
+            get_wait_policy().wait_for_idle(device, 'suggestion')
 
 
 def get_center_if_coordinate(s):
@@ -102,7 +106,7 @@ def execute(device, element, list):
             if operation == 'click':
                 ui_object.click()
             elif operation == 'long_click':
-                ui_object.long_click(1.5)
+                ui_object.long_click(get_wait_policy().long_press_duration)
     else:
         operation = list[-1]
         coor = get_center_if_coordinate(element.attrib.get('bounds', ''))
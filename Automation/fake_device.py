@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Offline replay of a recorded session (see session_tape.py).
+
+    python3 fake_device.py <session.tape.json.gz> [--repeat N] [--trace trace.json]
+
+Runs reproduce_bug against a FakeDevice and a chat session that answers
+with the recorded LLM responses, so the perception and command layers can
+be benchmarked without an emulator or an API key.
+"""
+
+import sys
+import time
+import argparse
+from hierarchy import *
+from snapshot import *
+from session_tape import *
+from my_gpt import ChatSession
+from response_cache import ResponseCacheMiss
+
+
+SELECTOR_ATTRIBUTES = {'text': 'text', 'description': 'content-desc', 'resourceId': 'resource-id',
+                       'className': 'class', 'packageName': 'package'}
+BOOLEAN_SELECTORS = ('scrollable', 'clickable', 'checkable', 'checked', 'enabled', 'focusable', 'selected')
+LAUNCHER_PACKAGE = 'com.android.launcher3'
+
+
+class FakeUiObjectNotFound(Exception):
+    pass
+
+
+class _FakeFling:
+    def __init__(self, ui_object):
+        self.ui_object = ui_object
+
+    def __call__(self):
+        return self.ui_object._act('fling')
+
+    @property
+    def vert(self):
+        return self
+
+    @property
+    def horiz(self):
+        return self
+
+    def toBeginning(self):
+        return self.ui_object._act('fling.toBeginning')
+
+    def toEnd(self):
+        return self.ui_object._act('fling.toEnd')
+
+
+class FakeUiObject:
+    def __init__(self, device, selector, element):
+        self.device = device
+        self.selector = selector
+        self.element = element
+
+    @property
+    def exists(self):
+        return self.element is not None
+
+    def __bool__(self):
+        return self.exists
+
+    @property
+    def info(self):
+        if self.element is None:
+            raise FakeUiObjectNotFound(self.selector)
+        return dict(self.element.attrib)
+
+    @property
+    def fling(self):
+        return _FakeFling(self)
+
+    def _act(self, action, *args):
+        if self.element is None:
+            raise FakeUiObjectNotFound(self.selector)
+        self.device.actions.append((action, self.selector) + args)
+        return True
+
+    def click(self):
+        self._act('click')
+        self.device.touch(self.element)
+
+    def long_click(self, duration=None):
+        self._act('long_click')
+        self.device.touch(self.element)
+
+    def set_text(self, text):
+        return self._act('set_text', text)
+
+    def get_text(self):
+        return self.info.get('text', '')
+
+
+class FakeSelector:
+    def __init__(self, device, selector):
+        self.device = device
+        self.selector = selector
+
+    def matches(self):
+        tree = self.device.tree()
+        elements = []
+        for element in tree.iter('node'):
+            attrib = element.attrib
+            ok = True
+            for key, value in self.selector.items():
+                if key in SELECTOR_ATTRIBUTES:
+                    ok = attrib.get(SELECTOR_ATTRIBUTES[key], '') == value
+                elif key == 'focused':
+                    focused = element is self.device.focused or attrib.get('focused') == 'true'
+                    ok = focused == value
+                elif key in BOOLEAN_SELECTORS:
+                    ok = (attrib.get(key) == 'true') == value
+                else:
+                    ok = False
+                if not ok:
+                    break
+            if ok:
+                elements.append(element)
+        return elements
+
+    def __getitem__(self, index):
+        elements = self.matches()
+        return FakeUiObject(self.device, self.selector, elements[index] if index < len(elements) else None)
+
+    def __getattr__(self, name):
+        # device(...).click() and friends act on the first match
+        return getattr(self[0], name)
+
+    def __bool__(self):
+        return bool(self.matches())
+
+
+class _FakeToast:
+    def __init__(self, device):
+        self.device = device
+
+    def get_message(self, wait_timeout=10, cache_timeout=10, default=None):
+        return self.device.screen.get('toast') or default
+
+
+class FakeDevice:
+    """
+    The part of the uiautomator2 Device surface ReBL uses, served from
+    recorded screens. SessionTape.command moves it to the screen that
+    followed each command in the recording; actions are only logged, except
+    for what the code reads back (focus, orientation, the foreground app).
+    """
+
+    def __init__(self, screen, serial='fake-replay'):
+        self.serial = serial
+        self.actions = []
+        self.toast = _FakeToast(self)
+        self.show(screen)
+
+    def show(self, screen):
+        self.screen = screen
+        self._tree = None
+        self._orientation = screen.get('orientation', 'natural')
+        self._package = None
+        self.focused = None
+
+    def tree(self):
+        if self._tree is None:
+            self._tree = parse_hierarchy(self.screen['xml'])
+        return self._tree
+
+    def dump_hierarchy(self, *args, **kwargs):
+        return self.screen['xml']
+
+    def app_current(self):
+        if self._package is not None:
+            return {'package': self._package, 'activity': f'{self._package}.Launcher'}
+        return {'package': self.screen['package'], 'activity': self.screen['activity']}
+
+    @property
+    def orientation(self):
+        return self._orientation
+
+    def set_orientation(self, orientation):
+        self.actions.append(('set_orientation', orientation))
+        self._orientation = orientation
+
+    def touch(self, element):
+        if element is not None and 'EditText' in element.attrib.get('class', ''):
+            self.focused = element
+
+    def click(self, x, y):
+        self.actions.append(('click', x, y))
+        self.touch(ScreenSnapshot(self.tree()).element_at(x, y))
+
+    def long_click(self, x, y, duration=None):
+        self.actions.append(('long_click', x, y))
+        self.touch(ScreenSnapshot(self.tree()).element_at(x, y))
+
+    def swipe_ext(self, direction, scale=0.9, **kwargs):
+        self.actions.append(('swipe_ext', direction, scale))
+
+    def press(self, key):
+        self.actions.append(('press', key))
+
+    def app_start(self, package_name, *args, **kwargs):
+        self.actions.append(('app_start', package_name))
+        self._package = None
+
+    def app_stop(self, package_name):
+        self.actions.append(('app_stop', package_name))
+        self._package = LAUNCHER_PACKAGE
+
+    @property
+    def last_toast(self):
+        return None
+
+    def clear_toast(self):
+        pass
+
+    def __call__(self, **selector):
+        return FakeSelector(self, selector)
+
+
+class ReplayChatSession(ChatSession):
+    """Answers each step with the response recorded for it."""
+
+    def __init__(self, tape, **kwargs):
+        super().__init__(**kwargs)
+        self.tape = tape
+
+    def generate(self, history):
+        self.sync(history)
+        message = self.tape.recorded_response()
+        if message is None:
+            raise ResponseCacheMiss(f"The recording has no response for step {self.tape.step_index}")
+        return message
+
+    def generate_stream(self, history, on_text):
+        message = self.generate(history)
+        on_text(message)
+        return message
+
+
+def replay(tape_path, trace_path=None):
+    """Re-run a recorded session offline; returns (result, tape, seconds)."""
+    # imported here: reproduction pulls in the whole pipeline
+    from reproduction import reproduce_bug
+    tape = SessionTape.load(tape_path)
+    if not tape.steps:
+        raise ValueError(f"{tape_path} has no recorded steps")
+    device = tape.device = FakeDevice(tape.steps[0]['screen'])
+    start = time.perf_counter()
+    result = reproduce_bug('replay', tape.data['meta']['bug_report'], device=device,
+                           chat_session=ReplayChatSession(tape), tape=tape, trace_path=trace_path,
+                           compact_history=False)
+    return result, tape, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded reproduction offline")
+    parser.add_argument('tape')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--trace', help="export a Chrome trace of the last run")
+    args = parser.parse_args()
+
+    timings = []
+    for run in range(args.repeat):
+        result, tape, seconds = replay(args.tape, args.trace if run == args.repeat - 1 else None)
+        timings.append(seconds)
+
+    recorded = tape.data.get('result') or {}
+    print(f"\nReplayed {len(tape.steps)} step(s) from {args.tape}")
+    print(f"Bug reproduced: {result['bug_reproduced']} (recorded: {recorded.get('bug_reproduced')})")
+    print(f"Divergences: {len(tape.divergences)}")
+    for divergence in tape.divergences[:10]:
+        print(f"  step {divergence['step']} command {divergence['command']}: {divergence['what']} "
+              f"expected {divergence['expected']!r}, got {divergence['actual']!r}")
+    timings.sort()
+    print(f"Seconds per replay: min {timings[0]:.3f}  median {timings[len(timings) // 2]:.3f}  max {timings[-1]:.3f}")
+    sys.exit(1 if tape.divergences else 0)
+
+
+if __name__ == "__main__":
+    main()
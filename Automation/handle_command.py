@@ -2,18 +2,25 @@ import re
 import time
 import random
 from hierarchy import *
+from snapshot import *
+from wait_policy import *
 
 
 def wait(duration=1):
     # Wait for the specified duration
-    time.sleep(duration)
+    if duration is None:
+        duration = 1
+    get_wait_policy().sleep('wait', duration)
 
 
+@traced('restart')
 def restart(device, package_name):  
+    policy = get_wait_policy()
     device.app_stop(package_name) 
-    time.sleep(2)
+    policy.wait_for_app_stopped(device, package_name)
     device.app_start(package_name)
-    time.sleep(2)
+    policy.wait_for_app_foreground(device, package_name)
+    policy.wait_for_idle(device, 'restart')
 
 def scroll(device, index = 0, direction=None):
     if direction == 'up' or  direction == 'top' or direction == None:
@@ -75,12 +82,12 @@ def multiple_selection(device, items, attribute_to_element_map):
             element = attribute_to_element_map.get(item, None)
             execute(device, element, {'feature':item, 'action':'click'})
     
-def change_status(device, element, command):
+def change_status(device, element, command, snapshot=None):
 
     current_status = command.get('current_status', '')
     target_status = command.get('target_status', '')
     if current_status != target_status:
-        return execute(device, element, command) 
+        return execute(device, element, command, snapshot) 
 def back(device):
     device.press('back')
 
@@ -89,11 +96,11 @@ def click(device, coor):
     return True
 
 def long_click(device, coor):
-    device.long_click(coor[0],coor[1], 1.5)
+    device.long_click(coor[0],coor[1], get_wait_policy().long_press_duration)
     return True
 
-def set_text(device, rep_attr, input_text, index):
-    ui_object = locate_ui_object(device, rep_attr, 'set_text', index)
+def set_text(device, rep_attr, input_text, index, snapshot=None):
+    ui_object = locate_ui_object(device, rep_attr, 'set_text', index, snapshot)
     if ui_object is None:
         return False
     elif input_text == None:
@@ -145,7 +152,35 @@ def get_bounds_dict(bounds):
     return bounds_dict
 
 
-def locate_ui_object(device, rep_attr, type=None, index = 0):
+class CoordinateTarget:
+    # Stands in for a UiObject when the node is only known by its bounds:
+    # acts on the bounds' center instead of querying the device per widget.
+    def __init__(self, device, element):
+        self.device = device
+        self.element = element
+
+    def click(self):
+        return click(self.device, get_center_if_coordinate(self.element.attrib.get('bounds', '')))
+
+    def long_click(self):
+        return long_click(self.device, get_center_if_coordinate(self.element.attrib.get('bounds', '')))
+
+    def set_text(self, text):
+        self.click()
+        return self.device(focused=True).set_text(text)
+
+
+def locate_ui_object(device, rep_attr, type=None, index = 0, snapshot=None):
+    # A fresh snapshot tells us which selector matches without asking the
+    # device. The screen may still have changed while the LLM was answering
+    # (a dialog, an async load), so a miss probes the live selectors below.
+    if is_fresh(snapshot):
+        key, element = snapshot.find(rep_attr, type, index)
+        if key in SELECTOR_KEYS:
+            return device(**{SELECTOR_KEYS[key]: rep_attr})[index]
+        if key is not None:
+            return CoordinateTarget(device, element)
+
     ui_object = device(text = rep_attr)[index]
     if ui_object:
         return ui_object
@@ -160,12 +195,10 @@ def locate_ui_object(device, rep_attr, type=None, index = 0):
 
     bounds_dict = get_bounds_dict(rep_attr)
     if bounds_dict is not None:
-        for ui_object in device():
-            if ui_object.info['bounds']==bounds_dict:
-                if type == None:
-                    return ui_object
-                if type == 'set_text' and 'EditText' in ui_object.info['className']:
-                    return ui_object
+        # one dump plus a spatial lookup instead of one info RPC per widget
+        element = ScreenSnapshot(get_current_hierarchy(device)).find_bounds(rep_attr, type)
+        if element is not None:
+            return CoordinateTarget(device, element)
 
 
 def get_element(attribute_to_element_map, command):
@@ -183,7 +216,7 @@ def get_element(attribute_to_element_map, command):
         element = None
     return element, None
 
-def execute(device, element, command):
+def execute(device, element, command, snapshot=None):
     
     rep_attr = command['feature']
     action = command['action']
@@ -191,7 +224,7 @@ def execute(device, element, command):
         
     if action == 'set_text':
         
-        return set_text(device, rep_attr, command.get('input_text', None), index)
+        return set_text(device, rep_attr, command.get('input_text', None), index, snapshot)
         
     if action in ['click', 'long_click']:
         if element is None:
@@ -200,7 +233,14 @@ def execute(device, element, command):
                 if coor:
                     globals()[action](device, coor)
                     return True
-            ui_object = locate_ui_object(device, rep_attr, index)
+            if is_fresh(snapshot):
+                key, element = snapshot.find(rep_attr, None, index)
+                coor = get_center_if_coordinate(element.attrib.get('bounds', '')) if element is not None else None
+                if coor:
+                    globals()[action](device, coor)
+                    return True
+            # not on the snapshot: ask the device itself
+            ui_object = locate_ui_object(device, rep_attr, None, index)
             if ui_object:
                 getattr(ui_object, action)()
                 return True
@@ -211,7 +251,8 @@ def execute(device, element, command):
                 return True
     return False
 
-def handle_command(command, device, attribute_to_element_map, package_name):
+@traced('command')
+def handle_command(command, device, attribute_to_element_map, package_name, snapshot=None):
     command_map = {
         'complete': lambda: None,
         'restart': lambda: restart(device, package_name),
@@ -233,13 +274,13 @@ def handle_command(command, device, attribute_to_element_map, package_name):
     elif command.get('current_status', '') and command.get('target_status', ''):
         element, warning = get_element(attribute_to_element_map, command)
         if warning is None:
-            return change_status(device, element, command)
+            return change_status(device, element, command, snapshot)
         else:
             return warning
     else:
         element, warning = get_element(attribute_to_element_map, command)
         if warning is None:
-            return execute(device, element, command)
+            return execute(device, element, command, snapshot)
         else:
             return warning
 
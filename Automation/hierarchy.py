@@ -1,17 +1,77 @@
 import uiautomator2 as u2
-import xml.etree.ElementTree as ET
+import hashlib
+from lxml import etree
 from collections import defaultdict
 from ElementTree_hepler import *
+from toast_collector import *
+from tracing import *
+from screen_diff import *
 import time
+from session_state import *
 
 
+# lxml parsers keep internal state and must not be shared between threads,
+# so every reproduction session gets its own parser.
+_session_parser = session_local(lambda: etree.XMLParser(encoding="utf-8", huge_tree=True))
 
-def get_current_hierarchy(device):
-    with open('tmp', 'w') as file:
-        file.write(device.dump_hierarchy())
-    xmlp = ET.XMLParser(encoding="utf-8")
-    tree = ET.parse('tmp', parser=xmlp)
-    return tree
+def get_hierarchy_parser():
+    return _session_parser.get()
+
+@traced('hierarchy')
+def parse_hierarchy(xml, parser=None):
+    # dump_hierarchy returns a str carrying an encoding declaration, which
+    # lxml only accepts as bytes
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    if parser is None:
+        parser = get_hierarchy_parser()
+    root = etree.fromstring(xml, parser=parser)
+    return etree.ElementTree(root)
+
+def get_current_hierarchy(device, parser=None):
+    with get_tracer().span('dump_hierarchy', 'dump'):
+        xml = device.dump_hierarchy()
+    return parse_hierarchy(xml, parser)
+
+FINGERPRINT_ATTRIBUTES = ('class', 'resource-id', 'text', 'content-desc', 'checked', 'enabled', 'selected', 'bounds')
+
+def hierarchy_fingerprint(tree, ignored_packages=('com.android.systemui',)):
+    # The status bar (clock, notifications) changes on its own and would keep
+    # the screen from ever looking stable.
+    digest = hashlib.sha1()
+    for element in tree.iter('node'):
+        attrib = element.attrib
+        if attrib.get('package', '') in ignored_packages:
+            continue
+        for key in FINGERPRINT_ATTRIBUTES:
+            digest.update(attrib.get(key, '').encode('utf-8'))
+            digest.update(b'\x1f')
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+def wait_for_stable_screen(device, timeout=2.0, interval=0.1, max_interval=0.8, backoff=2, previous_fingerprint=None):
+    """
+    Poll the hierarchy until two consecutive dumps have the same fingerprint.
+    Returns (tree, transient_tree); transient_tree is the last screen that was
+    seen and replaced before the UI settled, or None. previous_fingerprint is
+    the screen before the action: the first dumps often still show it, and
+    it is not a screen that quickly disappeared.
+    """
+    deadline = time.monotonic() + timeout
+    tree = get_current_hierarchy(device)
+    fingerprint = hierarchy_fingerprint(tree)
+    transient_tree = None
+    while time.monotonic() < deadline:
+        time.sleep(max(0, min(interval, deadline - time.monotonic())))
+        next_tree = get_current_hierarchy(device)
+        next_fingerprint = hierarchy_fingerprint(next_tree)
+        if next_fingerprint == fingerprint:
+            return next_tree, transient_tree
+        if fingerprint != previous_fingerprint:
+            transient_tree = tree
+        tree, fingerprint = next_tree, next_fingerprint
+        interval = min(interval * backoff, max_interval)
+    return tree, transient_tree
 
 def get_container_type(current_type, className, ):
 
@@ -116,7 +176,7 @@ def process_group_general(root, parent_map, info, attr_to_elements):
       
 
     
-    info['visited'].extend(visited_elements)
+    info['visited'].update(visited_elements)
     
     
     for key, value in attr_to_group_elments.items():
@@ -136,68 +196,69 @@ def process_group_general(root, parent_map, info, attr_to_elements):
 
 # Get elements that support operations like click, long click, and text input
 #root, package_name, parent_map, info, attribute_to_element_map
-def get_operable_elements(element, package_name, parent_map, info, attr_to_elements):
-    
-    if element.tag == 'node':
-        #Filter out elements with package "com.android.systemui"
-        if element.attrib.get('package', '') == 'com.android.systemui':
-            return
-        if element in info['visited']:
-            return 
-        clickable = element.attrib.get('clickable', 'false') == 'true'
-        long_clickable = element.attrib.get('long-clickable', 'false') == 'true'
-        text = element.attrib.get('text', '')
-        content_desc = element.attrib.get('content-desc', '')
-        resource_id = element.attrib.get('resource-id', '')
-        #'edittext' in resource_id
-        info['visited'].append(element)
-        if 'toolbar' in resource_id:
-            process_group_general(element, parent_map, info, attr_to_elements)
-        elif (clickable or long_clickable) and not (text or content_desc or resource_id):
-             process_group_general(element, parent_map, info, attr_to_elements)  
-        elif all_children_are_leaves(element) and is_clickable_or_has_clickable_children(element): 
-            process_group_general(element, parent_map, info, attr_to_elements)
-        elif (clickable or long_clickable):
-            if content_desc:
-                info['click'].append([content_desc])
-
-                #attr_to_elements[content_desc].append(element)
-                if content_desc in attr_to_elements:
-                    attr_to_elements[content_desc].append(element)
-                else:
-                    attr_to_elements.setdefault(content_desc, []).append(element)
-            elif text and len(text) < 100:
-                info['click'].append([text])
-                attr_to_elements[text].append(element)
-            elif resource_id:
-                info['click'].append([resource_id])
-                #attr_to_elements.setdefault(resource_id, []).append(element)
-                if resource_id in attr_to_elements:
-                    attr_to_elements[resource_id].append(element)
-                else:
-                    attr_to_elements.setdefault(resource_id, []).append(element)
-        elif text != '':
-            info['local_text'].append(text) 
-        
-    for child in element:
-        get_operable_elements(child, package_name, parent_map, info, attr_to_elements)
+# Walks the tree once in document order with an explicit stack; info['visited']
+# is a set, so skipping nodes already consumed by a group is O(1).
+def get_operable_elements(root, package_name, parent_map, info, attr_to_elements):
+    node_flags = build_node_flags(root)
+    visited = info['visited']
+    stack = [root]
+    while stack:
+        element = stack.pop()
+        if element.tag == 'node':
+            #Filter out elements with package "com.android.systemui"
+            if element.attrib.get('package', '') == 'com.android.systemui':
+                continue
+            if element in visited:
+                continue
+            clickable = element.attrib.get('clickable', 'false') == 'true'
+            long_clickable = element.attrib.get('long-clickable', 'false') == 'true'
+            text = element.attrib.get('text', '')
+            content_desc = element.attrib.get('content-desc', '')
+            resource_id = element.attrib.get('resource-id', '')
+            children_are_leaves, has_clickable = node_flags[element]
+            #'edittext' in resource_id
+            visited.add(element)
+            if 'toolbar' in resource_id:
+                process_group_general(element, parent_map, info, attr_to_elements)
+            elif (clickable or long_clickable) and not (text or content_desc or resource_id):
+                 process_group_general(element, parent_map, info, attr_to_elements)  
+            elif children_are_leaves and has_clickable: 
+                process_group_general(element, parent_map, info, attr_to_elements)
+            elif (clickable or long_clickable):
+                if content_desc:
+                    info['click'].append([content_desc])
+
+                    #attr_to_elements[content_desc].append(element)
+                    if content_desc in attr_to_elements:
+                        attr_to_elements[content_desc].append(element)
+                    else:
+                        attr_to_elements.setdefault(content_desc, []).append(element)
+                elif text and len(text) < 100:
+                    info['click'].append([text])
+                    attr_to_elements[text].append(element)
+                elif resource_id:
+                    info['click'].append([resource_id])
+                    #attr_to_elements.setdefault(resource_id, []).append(element)
+                    if resource_id in attr_to_elements:
+                        attr_to_elements[resource_id].append(element)
+                    else:
+                        attr_to_elements.setdefault(resource_id, []).append(element)
+            elif text != '':
+                info['local_text'].append(text) 
+
+        stack.extend(reversed(element))
     
 
+def new_screen_info():
+    return {'toolbar':[], 'set_text':[], 'click':[], 'spinner':[], 'check_box':[], 'switch_widget':[], 'scrollable':[], 'local_text':[],'visited':set()}
+
 def get_sequential_info(info, activity, orientation, toast):
     info['Other Widgets with Text in This Page'] = info["local_text"]
     del info["visited"]
     del info["local_text"]
 
     info = {k: v for k, v in info.items() if v != [] and v != [[]]}
-   
-    info_string = ''
-    for key, values in info.items():
-        info_string += f"{key} has the following group(s):"
-        i = 1
-        for v in values:
-            info_string +=  f"{i}#.{v};" 
-            i +=1
-        #info_string +="\n"
+    info_string = format_groups(info)
     if toast is not None:
         return f"\n*Current Screen Information:  #Current Activity: {activity}. # UI Information:{info_string}.Toast message on the page: {toast}" 
     else:
@@ -206,23 +267,34 @@ def get_sequential_info(info, activity, orientation, toast):
 
 
 
-def get_screen_information(device, attribute_to_element_map, package_name):
-    try:
-        toast = device.toast.get_message(2, 5, None)
-    except:
-        toast = None
+@traced('hierarchy')
+def get_screen_information(device, attribute_to_element_map, package_name, tree=None, delta=False):
+    collector = get_toast_collector(device)
+    if collector is not None:
+        toast = collector.get_message()
+    else:
+        try:
+            with get_tracer().span('toast.get_message', 'toast'):
+                toast = device.toast.get_message(2, 5, None)
+        except:
+            toast = None
     #toast = device.last_toast
     
-    tree = get_current_hierarchy(device)
+    if tree is None:
+        tree = get_current_hierarchy(device)
     root = tree.getroot()
     parent_map = build_parent_map(tree)
-    info = {'toolbar':[], 'set_text':[], 'click':[], 'spinner':[], 'check_box':[], 'switch_widget':[], 'scrollable':[], 'local_text':[],'visited':[]}
+    info = new_screen_info()
    
     activity = device.app_current()['activity']
     get_operable_elements(root, package_name, parent_map, info, attribute_to_element_map)
-  
-
-    return info, get_sequential_info(info, activity, device.orientation, toast)
+    orientation = device.orientation
+    description = get_sequential_info(info, activity, orientation, toast)
+    # delta: describe the screen relative to the previous turn's, if enabled
+    encoder = get_screen_encoder() if delta else None
+    if encoder is not None:
+        description = encoder.encode(info, activity, orientation, toast, description)
+    return info, description
 
 def print_screen_information_testing(emulator_id):
 
@@ -0,0 +1,183 @@
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+from token_counter import *
+from response_cache import *
+from event_log import *
+from rate_limiter import *
+from session_state import *
+
+
+SUMMARY_HEADER = 'Summary of the reproduction so far (older turns were compacted):'
+SUMMARY_INSTRUCTION = ('Summarize the following part of an Android bug reproduction conversation for the assistant '
+                       'that continues it. Keep every action executed and its outcome, the activities and screens '
+                       'visited, what was tried without success and which steps of the bug report remain. '
+                       'Be concise and do not add advice.')
+
+
+class HistoryCompactor:
+    """
+    Keeps the chat history under the token limit by summarizing older turns
+    in the background with a cheaper model while the reproduction goes on.
+    The first prefix_len messages (rules, examples and the bug report) and
+    the last keep_turns turns are never summarized; the turns in between
+    are replaced by one summary message once it is ready. Only when the
+    history reaches block_threshold before the summary is done does a turn
+    wait for it, for at most max_wait seconds. Once the history is over the
+    limit anyway, compact_now summarizes synchronously; should the old
+    summarize-and-reload fallback still replace the history, reset() points
+    the compactor at the new one.
+    """
+
+    def __init__(self, prefix_len, model_name='models/gemini-2.5-flash', keep_turns=4,
+                 start_threshold=0.5, block_threshold=0.7, max_wait=60):
+        self.prefix_len = prefix_len
+        self.model_name = model_name
+        self.keep_turns = keep_turns
+        self.start_threshold = start_threshold
+        self.block_threshold = block_threshold
+        self.max_wait = max_wait
+        self.summarized = False  # history[prefix_len] is our summary
+        self.job = None
+        self.pending = None  # (first message, last message, end) being summarized
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-compactor')
+        self.stats = {'compactions': 0, 'failures': 0, 'tokens_removed': 0, 'summarize_seconds': 0.0,
+                      'blocked_seconds': 0.0}
+
+    def split_point(self, history):
+        """Index of the first kept message: the user message starting the last keep_turns turns."""
+        end, turns = len(history), 0
+        while end > self.prefix_len and turns < self.keep_turns:
+            end -= 1
+            if history[end]['role'] == 'user' and (end == 0 or history[end - 1]['role'] != 'user'):
+                turns += 1
+        return end
+
+    def submit(self, history):
+        end = self.split_point(history)
+        # nothing older than the kept turns, apart from an earlier summary
+        if end - self.prefix_len <= (1 if self.summarized else 0):
+            return
+        messages = history[self.prefix_len:end]
+        self.pending = (messages[0], messages[-1], end)
+        self.job = self.executor.submit(self.summarize, messages)
+
+    def summarize(self, messages):
+        start = time.monotonic()
+        text = SUMMARY_INSTRUCTION + '\n\n' + ''.join(f"{m['role'].capitalize()}: {m['content']}\n\n" for m in messages)
+        cache = get_response_cache()
+        key = None
+        if cache is not None:
+            key = cache.make_key(self.model_name, {}, hashlib.sha256(text.encode('utf-8')).hexdigest())
+            summary = cache.get(key)
+            if summary is not None:
+                return summary, time.monotonic() - start
+            if cache.replay_only:
+                raise ResponseCacheMiss(f"No recorded summary for this history ({key[:12]})")
+        model = genai.GenerativeModel(self.model_name)
+
+        def generate():
+            get_rate_limiter().acquire()
+            return model.generate_content(text).text
+        summary = call_with_retry(generate)
+        if cache is not None:
+            cache.put(key, self.model_name, summary)
+        return summary, time.monotonic() - start
+
+    def apply(self, history):
+        """history with the finished summary swapped in, or history itself."""
+        job, (first, last, end) = self.job, self.pending
+        self.job = self.pending = None
+        try:
+            summary, seconds = job.result()
+        except Exception as e:
+            print(f"History compaction failed: {type(e).__name__}: {e}")
+            self.stats['failures'] += 1
+            get_event_log().emit('compaction_failed', message=f"{type(e).__name__}: {e}")
+            return history
+        # the history was replaced meanwhile (e.g. by the blocking fallback)
+        if end > len(history) or history[self.prefix_len] is not first or history[end - 1] is not last:
+            return history
+
+        counter = get_token_counter()
+        before = counter.sync(history)
+        compacted = history[:self.prefix_len] + [{"role": "user", "content": f"{SUMMARY_HEADER} {summary}"}] + history[end:]
+        after = counter.sync(compacted)
+        self.summarized = True
+        self.stats['compactions'] += 1
+        self.stats['tokens_removed'] += before - after
+        self.stats['summarize_seconds'] += seconds
+        print(f"Compacted {end - self.prefix_len} message(s): {before} -> {after} tokens")
+        get_event_log().emit('compaction', seconds, messages=end - self.prefix_len,
+                             tokens_before=before, tokens_after=after, model=self.model_name)
+        return compacted
+
+    def wait(self, deadline=None):
+        """Block on the running summary for at most max_wait seconds, ending by deadline."""
+        start = time.monotonic()
+        max_wait = self.max_wait if deadline is None else max(min(self.max_wait, deadline - start), 0)
+        try:
+            self.job.result(timeout=max_wait)
+        except Exception:
+            pass  # still running after a timeout; failures are reported by apply
+        self.stats['blocked_seconds'] += time.monotonic() - start
+
+    def compact(self, history, max_tokens, deadline=None):
+        """Called before each turn; returns the history to continue with. A blocking wait ends by deadline."""
+        # keeps failing (no network, replay-only cache): leave it to the blocking fallback
+        if self.stats['failures'] >= 3:
+            return history
+        total = get_token_counter().sync(history)
+        if self.job is not None and not self.job.done() and total > max_tokens * self.block_threshold:
+            self.wait(deadline)
+        if self.job is not None and self.job.done():
+            history = self.apply(history)
+            total = get_token_counter().sync(history)
+        if self.job is None and total > max_tokens * self.start_threshold:
+            self.submit(history)
+        return history
+
+    def compact_now(self, history, limit, deadline=None):
+        """Summarize until the history is within limit tokens, waiting for it; returns the history to continue with."""
+        # a summary already under way covers older turns: finish it, then summarize what is left
+        for _ in range(2):
+            if self.stats['failures'] >= 3:
+                break
+            if self.job is None:
+                self.submit(history)
+            if self.job is None:
+                break
+            self.wait(deadline)
+            if not self.job.done():
+                break
+            history = self.apply(history)
+            if get_token_counter().sync(history) <= limit:
+                break
+        return history
+
+    def reset(self, prefix_len):
+        """The history was replaced: its first prefix_len messages are the new fixed prefix."""
+        # a summary still running refers to the old list; apply would drop it anyway
+        self.job = self.pending = None
+        self.summarized = False
+        self.prefix_len = prefix_len
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def format_summary(self):
+        stats = self.stats
+        return (f"History compaction: {stats['compactions']} summaries ({stats['failures']} failed), "
+                f"{stats['tokens_removed']} tokens removed, {stats['summarize_seconds']:.1f}s summarizing "
+                f"in the background, {stats['blocked_seconds']:.1f}s blocked")
+
+
+# None when compaction is off
+_session_compactor = session_local()
+
+def get_history_compactor():
+    return _session_compactor.get()
+
+def set_history_compactor(compactor):
+    return _session_compactor.set(compactor)
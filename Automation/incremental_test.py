@@ -7,47 +7,102 @@ Tests APKs one by one with their corresponding BRs and logs results to CSV incre
 import os
 import sys
 import csv
+import glob
 import json
+import argparse
 import time
+import queue
+import threading
 import subprocess
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
+from device_pool import *
+from reproduction_runner import *
+from event_log import *
+from app_reset import *
+
+
+FAILED_STATUSES = ('ERROR', 'TIMEOUT', 'UNKNOWN', 'INSTALL_FAILED')
+
+CSV_HEADERS = [
+    'Test_ID',
+    'Timestamp',
+    'APK_Name',
+    'BR_File',
+    'App_Name',
+    'Package_Name',
+    'Issue_Number',
+    'Status',
+    'Duration_Seconds',
+    'Total_Commands',
+    'GPT_Responses',
+    'Bug_Reproduced',
+    'Failure_Reason',
+    'Log_File',
+    'Remarks',
+    'Device',
+    'Reset_Level',
+    'Reset_Seconds'
+]
 
 
 class IncrementalTester:
-    def __init__(self, device_port):
-        self.device_port = device_port
-        self.apk_dir = "APKs"
-        self.br_dir = "BRs"
-        self.results_file = f"test_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    def __init__(self, device_ports, results_file=None, headless=False, runner='subprocess', timeout=300, trace=False,
+                 reset='none', snapshots=False):
+        if isinstance(device_ports, str):
+            device_ports = [device_ports]
+        self.device_ports = [serial_to_port(p) for p in device_ports]
+        self.device_port = self.device_ports[0]
+        self.adb_path = os.path.expanduser("~/Library/Android/sdk/platform-tools/adb")
+        # relative to this script, whatever directory the batch is started from
+        self.script_dir = os.path.dirname(os.path.abspath(__file__))
+        self.apk_dir = os.path.join(self.script_dir, "APKs")
+        self.br_dir = os.path.join(self.script_dir, "BRs")
+        self.headless = headless
+        # subprocess: a fresh reproduction.py per test; inprocess: call
+        # reproduce_bug in this process; process: one long-lived worker per device
+        self.runner = runner
+        self.timeout = timeout
+        # export a Chrome trace per test next to its event stream
+        self.trace = trace
+        # none: the APK is assumed installed (previous behaviour); auto: the
+        # cheapest clean reset (see app_reset.py); or force a minimum level
+        self.reset = reset
+        # per-APK emulator snapshots only persist on writable emulators
+        # (emulator_pool.py up --writable); the pool boots read-only by default
+        self.snapshots = snapshots
+        self.resetters = {}
+        self.workers = {}
+        if runner == 'inprocess':
+            os.environ.update(self.android_env())
+        # absolute: the in-process runners change to the script directory
+        self.results_file = os.path.abspath(results_file or f"test_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        # completed tests, one JSON object per line, next to the results CSV
+        self.journal_file = os.path.splitext(self.results_file)[0] + '.journal.jsonl'
+        # one JSON Lines event stream per test (see event_log.py)
+        self.events_dir = os.path.splitext(self.results_file)[0] + '_events'
         self.test_cases = []
-        
-        # Initialize CSV file
-        self.init_csv()
+        # workers share one results file; rows are written under this lock
+        self.csv_lock = threading.Lock()
+        
+        # Initialize CSV file, or keep appending to the one being resumed
+        # in the columns it was written with
+        self.csv_fields = CSV_HEADERS
+        if os.path.exists(self.results_file):
+            with open(self.results_file, newline='') as f:
+                self.csv_fields = next(csv.reader(f), None) or CSV_HEADERS
+            missing = [field for field in CSV_HEADERS if field not in self.csv_fields]
+            if missing:
+                print(f"Note: {self.results_file} has no {', '.join(missing)} column(s); they are not logged")
+            print(f"Appending to results file: {self.results_file}\n")
+        else:
+            self.init_csv()
     
     def init_csv(self):
         """Initialize CSV file with headers"""
-        headers = [
-            'Test_ID',
-            'Timestamp',
-            'APK_Name',
-            'BR_File',
-            'App_Name',
-            'Package_Name',
-            'Issue_Number',
-            'Status',
-            'Duration_Seconds',
-            'Total_Commands',
-            'GPT_Responses',
-            'Bug_Reproduced',
-            'Failure_Reason',
-            'Log_File',
-            'Remarks'
-        ]
-        
         with open(self.results_file, 'w', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow(headers)
+            writer.writerow(CSV_HEADERS)
         
         print(f"Created results file: {self.results_file}\n")
     
@@ -226,46 +281,42 @@ class IncrementalTester:
         
         return metrics
     
-    def install_apk(self, apk_file, package_name):
+    def install_apk(self, apk_file, package_name, device_port=None):
         """Install APK on the device"""
         apk_path = os.path.join(self.apk_dir, apk_file)
-        device_serial = f"emulator-{self.device_port}"
-        adb_path = os.path.expanduser("~/Library/Android/sdk/platform-tools/adb")
         
         print(f"Installing {apk_file}...")
         try:
-            # Uninstall existing version if present
-            if package_name:
-                subprocess.run(
-                    [adb_path, '-s', device_serial, 'uninstall', package_name],
-                    capture_output=True,
-                    timeout=30
-                )
-            
-            # Install APK
-            result = subprocess.run(
-                [adb_path, '-s', device_serial, 'install', '-r', apk_path],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-            
-            if result.returncode == 0:
+            if self.get_resetter(device_port).install(apk_path, package_name):
                 print("✓ APK installed successfully")
                 return True
-            else:
-                print(f"✗ Installation failed: {result.stderr}")
-                return False
+            return False
                 
         except Exception as e:
             print(f"✗ Installation error: {e}")
             return False
     
-    def run_test(self, test_id, apk_file, br_file):
-        """Run a single test and log results to CSV"""
+    def get_resetter(self, device_port=None):
+        device_port = device_port or self.device_port
+        with self.csv_lock:
+            if device_port not in self.resetters:
+                self.resetters[device_port] = AppResetter(device_port, adb_path=self.adb_path,
+                                                          snapshots=self.snapshots)
+            return self.resetters[device_port]
+    
+    def run_test(self, test_id, apk_file, br_file, device_port=None, confirm=True, should_retry=None):
+        """
+        Run a single test and log results to CSV. should_retry(status) is asked
+        before anything is logged; when it says yes nothing is written and
+        'REQUEUED' is returned, so a retried test keeps a single row.
+        """
+        device_port = device_port or self.device_port
+        # prefix streamed output when several devices print at once
+        prefix = f"[emulator-{device_port}] " if len(self.device_ports) > 1 else ''
         print(f"\n{'=' * 80}")
         print(f"Test #{test_id}: {br_file}")
         print(f"APK: {apk_file}")
+        print(f"Device: emulator-{device_port}")
         print(f"{'=' * 80}")
         
         # Extract BR info
@@ -276,20 +327,26 @@ class IncrementalTester:
         print()
         
         # Wait for user confirmation before starting this test
-        input(f"Press Enter to start test #{test_id} (or Ctrl+C to cancel)...")
-        print()
-        
-        # Note: Assuming APK is already installed on emulator
-        # Uncomment below if you need to install APKs before testing:
-        # if not self.install_apk(apk_file, package_name):
-        #     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        #     row = [test_id, timestamp, apk_file, br_file, app_name, package_name, 
-        #            issue_number, 'INSTALL_FAILED', '0', 0, 0, 'No', 
-        #            'APK installation failed', '', 'Skipped due to installation failure']
-        #     with open(self.results_file, 'a', newline='') as f:
-        #         writer = csv.writer(f)
-        #         writer.writerow(row)
-        #     return 'INSTALL_FAILED', 0
+        if confirm:
+            input(f"Press Enter to start test #{test_id} (or Ctrl+C to cancel)...")
+            print()
+        
+        # Note: with --reset none the APK is assumed to be installed already
+        reset_level, reset_seconds = '', 0.0
+        if self.reset != 'none':
+            min_level = 'clear' if self.reset == 'auto' else self.reset
+            print(f"Resetting app state (at least: {min_level})...")
+            level, reset_seconds = self.get_resetter(device_port).reset(
+                os.path.join(self.apk_dir, apk_file), package_name, min_level)
+            reset_level = level or 'FAILED'
+            print(f"Reset: {reset_level} in {reset_seconds:.1f}s\n")
+            if level is None:
+                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                row = [test_id, timestamp, apk_file, br_file, app_name, package_name, 
+                       issue_number, 'INSTALL_FAILED', '0', 0, 0, 'No', 
+                       'APK installation failed', '', 'Skipped due to installation failure',
+                       f'emulator-{device_port}', reset_level, f'{reset_seconds:.2f}']
+                return self.log_result(row, 0, should_retry)
         
         # Start test
         start_time = time.time()
@@ -310,52 +367,19 @@ class IncrementalTester:
             print("Running reproduction script...")
             print(f"{'=' * 80}\n")
             
-            # Prepare command and environment
-            script_dir = os.path.dirname(os.path.abspath(__file__))
             br_path = f'BRs/{br_file}'
-            
-            # Set up environment with Android SDK paths
-            env = os.environ.copy()
-            android_sdk = os.path.expanduser("~/Library/Android/sdk")
-            path_additions = f"{android_sdk}/platform-tools:{android_sdk}/emulator"
-            env['PATH'] = f"{path_additions}:{env.get('PATH', '')}"
-            env['ANDROID_SDK_ROOT'] = android_sdk
-            
-            # Run the reproduction script with real-time output (like run.sh)
-            # We'll capture output in a variable while still showing it
-            output_lines = []
-            process = subprocess.Popen(
-                ['python3', 'reproduction.py', self.device_port, br_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                cwd=script_dir,
-                env=env
-            )
-            
-            # Read and display output in real-time
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    print(line, end='')
-                    output_lines.append(line)
-            
-            # Wait for process to complete (with timeout)
-            try:
-                return_code = process.wait(timeout=300)
-            except subprocess.TimeoutExpired:
-                process.kill()
-                raise
+            events_path = self.events_file(test_id, br_file)
+            trace_path = os.path.splitext(events_path)[0] + '.trace.json' if self.trace else None
+            if self.runner == 'subprocess':
+                metrics, return_code = self.run_reproduction_subprocess(device_port, br_path, events_path, trace_path, prefix)
+            else:
+                metrics, return_code = self.run_reproduction_worker(device_port, br_path, events_path, trace_path)
             
             duration = time.time() - start_time
-            output = ''.join(output_lines)
             
             print(f"\n{'=' * 80}")
             print(f"Exit code: {return_code}")
             
-            # Parse output
-            metrics = self.parse_test_output(output)
-            
             # Determine status
             if metrics['bug_reproduced']:
                 status = 'SUCCESS'
@@ -378,9 +402,17 @@ class IncrementalTester:
         except subprocess.TimeoutExpired:
             duration = time.time() - start_time
             status = 'TIMEOUT'
-            metrics['failure_reason'] = 'Test exceeded 5 minute timeout'
-            remarks = 'Timeout after 300 seconds'
-            print(f"\n⏱ Test timed out after {duration:.1f}s")
+            # what the run got through before it was stopped
+            partial = summarize_events(events_path)
+            metrics['gpt_responses'] = partial.gpt_responses
+            metrics['total_commands'] = partial.total_commands
+            metrics['failure_reason'] = f'Test exceeded {self.timeout / 60:g} minute timeout'
+            if partial.failure_reason:
+                metrics['failure_reason'] += f' ({partial.failure_reason})'
+            metrics['log_file'] = events_path if os.path.exists(events_path) else ''
+            remarks = f'Timeout after {self.timeout} seconds'
+            print(f"\n⏱ Test timed out after {duration:.1f}s "
+                  f"({partial.gpt_responses} responses, {partial.total_commands} commands)")
             
         except Exception as e:
             duration = time.time() - start_time
@@ -405,23 +437,233 @@ class IncrementalTester:
             'Yes' if metrics['bug_reproduced'] else 'No',
             metrics['failure_reason'],
             metrics['log_file'],
-            remarks
+            remarks,
+            f'emulator-{device_port}',
+            reset_level,
+            f'{reset_seconds:.2f}'
         ]
         
-        with open(self.results_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(row)
-        
+        return self.log_result(row, duration, should_retry)
+    
+    def log_result(self, row, duration, should_retry=None):
+        """Write a test's row and journal entry once its outcome is final"""
+        test_id, apk_file, br_file, status = row[0], row[2], row[3], row[7]
+        if should_retry is not None and should_retry(status):
+            return 'REQUEUED', duration
+        self.write_row(row)
+        self.checkpoint(test_id, apk_file, br_file, status, duration)
         print(f"✓ Result logged to {self.results_file}")
-        
         return status, duration
     
-    def run_all_tests(self):
+    def android_env(self):
+        """Environment with the Android SDK tools on PATH"""
+        env = os.environ.copy()
+        android_sdk = os.path.expanduser("~/Library/Android/sdk")
+        path_additions = f"{android_sdk}/platform-tools:{android_sdk}/emulator"
+        env['PATH'] = f"{path_additions}:{env.get('PATH', '')}"
+        env['ANDROID_SDK_ROOT'] = android_sdk
+        return env
+    
+    def events_file(self, test_id, br_file):
+        """Fresh event stream path for this test; a re-run replaces the old one"""
+        path = os.path.join(self.events_dir, f"{test_id:03d}_{os.path.splitext(br_file)[0]}.jsonl")
+        if os.path.exists(path):
+            os.remove(path)
+        return path
+    
+    def run_reproduction_subprocess(self, device_port, br_path, events_path, trace_path=None, prefix=''):
+        """
+        Run reproduction.py in a fresh interpreter. Its event stream is
+        followed while it runs, so a hung child is still stopped at the
+        timeout and what it got through is known.
+        """
+        # Run the reproduction script with real-time output (like run.sh).
+        # Only the tail is kept, for an error message if the child dies
+        # before writing any events
+        output_tail = deque(maxlen=50)
+        env = self.android_env()
+        if trace_path:
+            env['REBL_TRACE'] = os.path.abspath(trace_path)
+        process = subprocess.Popen(
+            ['python3', 'reproduction.py', device_port, br_path, os.path.abspath(events_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            cwd=self.script_dir,
+            env=env
+        )
+        
+        # Display output in real-time on its own thread: a child that stops
+        # printing must not keep us from the timeout
+        def relay_output():
+            for line in iter(process.stdout.readline, ''):
+                print(f"{prefix}{line}", end='')
+                output_tail.append(line)
+        reader = threading.Thread(target=relay_output, name=f'output-{device_port}', daemon=True)
+        reader.start()
+        
+        tail = EventTail(events_path)
+        deadline = time.monotonic() + self.timeout
+        last_event, last_change, warned = None, time.monotonic(), False
+        while process.poll() is None:
+            tail.poll()
+            if tail.last_event is not last_event:
+                last_event, last_change, warned = tail.last_event, time.monotonic(), False
+            elif not warned and time.monotonic() - last_change > 60:
+                stuck_after = last_event['event'] if last_event else 'start'
+                print(f"{prefix}No events for 60s (last: {stuck_after}, {tail.summary.gpt_responses} responses, "
+                      f"{tail.summary.total_commands} commands)")
+                warned = True
+            if time.monotonic() >= deadline:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(process.args, self.timeout, output=''.join(output_tail))
+            time.sleep(0.5)
+        return_code = process.returncode
+        reader.join(timeout=5)
+        
+        summary = tail.poll()
+        if not summary.finished and not summary.failure_reason:
+            metrics = self.parse_test_output(''.join(output_tail))
+        else:
+            metrics = summary.metrics()
+        metrics['log_file'] = events_path if os.path.exists(events_path) else ''
+        return metrics, return_code
+    
+    def run_reproduction_worker(self, device_port, br_path, events_path, trace_path=None):
+        """
+        Call reproduce_bug directly, in this process or in the device's
+        long-lived worker, and take its result instead of parsing stdout
+        """
+        # leave the worker a margin to stop on its own and report its counts
+        max_seconds = max(self.timeout - 30, 1)
+        if self.runner == 'process':
+            with self.csv_lock:
+                if device_port not in self.workers:
+                    self.workers[device_port] = ReproductionWorker(device_port)
+                worker = self.workers[device_port]
+            outcome = worker.run(br_path, self.timeout, max_seconds, events_path, trace_path)
+            if outcome is None:
+                raise subprocess.TimeoutExpired(f'reproduce_bug({device_port}, {br_path})', self.timeout)
+            result, return_code = outcome
+        else:
+            result, return_code = run_reproduction(device_port, br_path, max_seconds, events_path, trace_path)
+        if result.get('timed_out'):
+            raise subprocess.TimeoutExpired(f'reproduce_bug({device_port}, {br_path})', self.timeout)
+        
+        metrics = {key: result.get(key, default) for key, default in
+                   (('total_commands', 0), ('gpt_responses', 0), ('bug_reproduced', False),
+                    ('failure_reason', ''))}
+        metrics['log_file'] = events_path if os.path.exists(events_path) else ''
+        return metrics, return_code
+    
+    def close(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self.workers = {}
+    
+    def write_row(self, row):
+        """row is in CSV_HEADERS order; it is written in the file's own column order"""
+        values = dict(zip(CSV_HEADERS, row))
+        with self.csv_lock:
+            with open(self.results_file, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.csv_fields, extrasaction='ignore', restval='')
+                writer.writerow(values)
+
+    def checkpoint(self, test_id, apk_file, br_file, status, duration):
+        """Durably record a finished test so an interrupted batch can resume"""
+        entry = {
+            'test_id': test_id,
+            'apk': apk_file,
+            'br': br_file,
+            'status': status,
+            'duration': round(duration, 2),
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        with self.csv_lock:
+            with open(self.journal_file, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load_journal(self):
+        """Last recorded status per (apk, br)"""
+        statuses = {}
+        if not os.path.exists(self.journal_file):
+            return statuses
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                statuses[(entry['apk'], entry['br'])] = entry['status']
+        return statuses
+
+    def select_pending(self, cases, only_failures=False):
+        """
+        Drop tests the journal already has. With only_failures, keep just the
+        journaled tests whose last run failed.
+        """
+        statuses = self.load_journal()
+        if only_failures:
+            return [case for case in cases if statuses.get((case[1], case[2])) in FAILED_STATUSES]
+        return [case for case in cases if (case[1], case[2]) not in statuses]
+
+    def run_tests_on_pool(self, pool, cases, max_retries=1):
+        """
+        Run cases, (test_id, apk, br), concurrently, one worker thread per
+        device. A test whose device gets quarantined is put back for the
+        remaining devices, so workers wait for new jobs until every test has
+        a final result (or their own device is quarantined).
+        """
+        jobs = queue.Queue()
+        for test_id, apk_file, br_file in cases:
+            jobs.put((test_id, apk_file, br_file, 0))
+        results = []
+        results_lock = threading.Lock()
+
+        def worker(serial):
+            while not pool.is_quarantined(serial):
+                try:
+                    test_id, apk_file, br_file, retries = jobs.get(timeout=1)
+                except queue.Empty:
+                    # another worker may still re-queue the test it is running
+                    with results_lock:
+                        if len(results) == len(cases):
+                            return
+                    continue
+
+                def should_retry(status):
+                    healthy = pool.report(serial, status not in ('ERROR', 'TIMEOUT'))
+                    return not healthy and retries < max_retries and bool(pool.healthy())
+
+                status, duration = self.run_test(test_id, apk_file, br_file, serial_to_port(serial), confirm=False,
+                                                 should_retry=should_retry)
+                if status == 'REQUEUED':
+                    print(f"Re-queueing test #{test_id} after quarantining {serial}")
+                    jobs.put((test_id, apk_file, br_file, retries + 1))
+                    continue
+                with results_lock:
+                    results.append({'test_id': test_id, 'status': status, 'duration': duration})
+
+        threads = [threading.Thread(target=worker, args=(serial,), name=serial) for serial in pool.healthy()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if not jobs.empty():
+            print(f"Warning: {jobs.qsize()} test(s) not run, no healthy device left")
+        return sorted(results, key=lambda r: r['test_id'])
+
+    def run_all_tests(self, only_failures=False):
         """Run all tests and display summary"""
         print("=" * 80)
         print("INCREMENTAL BUG REPRODUCTION TESTING")
         print("=" * 80)
-        print(f"Device: emulator-{self.device_port}")
+        print(f"Device(s): {', '.join(f'emulator-{p}' for p in self.device_ports)}")
         print(f"Results file: {self.results_file}\n")
         
         # Get test cases
@@ -444,15 +686,29 @@ class IncrementalTester:
             for br in brs:
                 print(f"    └─ {br}")
         
+        # Test IDs stay tied to the mapping order so resumed runs keep them
+        cases = [(i, apk, br) for i, (apk, br) in enumerate(self.test_cases, 1)]
+        pending = self.select_pending(cases, only_failures)
+        if len(pending) != len(cases):
+            print(f"\nResuming from {self.journal_file}: {len(pending)} of {len(cases)} test(s) to run")
+        if not pending:
+            print("Nothing left to run.")
+            return
+        
         print(f"\n{'=' * 80}")
-        input("Press Enter to start testing (or Ctrl+C to cancel)...")
+        if not self.headless:
+            input("Press Enter to start testing (or Ctrl+C to cancel)...")
         print()
         
         # Run tests
-        results = []
-        for i, (apk_file, br_file) in enumerate(self.test_cases, 1):
-            status, duration = self.run_test(i, apk_file, br_file)
-            results.append({'status': status, 'duration': duration})
+        if len(self.device_ports) > 1:
+            pool = DevicePool(self.device_ports, adb_path=self.adb_path)
+            results = self.run_tests_on_pool(pool, pending)
+        else:
+            results = []
+            for test_id, apk_file, br_file in pending:
+                status, duration = self.run_test(test_id, apk_file, br_file, confirm=not self.headless)
+                results.append({'status': status, 'duration': duration})
         
         # Display summary
         self.display_summary(results)
@@ -464,6 +720,9 @@ class IncrementalTester:
         print("=" * 80)
         
         total = len(results)
+        if total == 0:
+            print("\nNo tests were run.")
+            return
         success = sum(1 for r in results if r['status'] == 'SUCCESS')
         completed = sum(1 for r in results if r['status'] == 'COMPLETED')
         timeout = sum(1 for r in results if r['status'] == 'TIMEOUT')
@@ -487,24 +746,72 @@ class IncrementalTester:
         print(f"{'=' * 80}\n")
 
 
+def latest_results_file():
+    files = sorted(glob.glob('test_results_*.csv'), key=os.path.getmtime)
+    return files[-1] if files else None
+
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 incremental_test.py <device_port>")
-        print("Example: python3 incremental_test.py 5554")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Run the APK/BR mapping through reproduction.py",
+        epilog="Example: python3 incremental_test.py --headless 5554 5556")
+    parser.add_argument('device_ports', nargs='+', help="emulator ports, or 'auto' for every running emulator")
+    parser.add_argument('--headless', action='store_true', help="never prompt; for unattended runs")
+    resume = parser.add_mutually_exclusive_group()
+    resume.add_argument('--resume', metavar='RESULTS_CSV', help="continue the batch logged to RESULTS_CSV")
+    resume.add_argument('--resume-latest', action='store_true',
+                        help="continue the batch of the newest test_results_*.csv")
+    parser.add_argument('--only-failures', action='store_true',
+                        help="with --resume/--resume-latest, re-run only tests whose last run failed")
+    parser.add_argument('--runner', choices=('subprocess', 'inprocess', 'process'), default='subprocess',
+                        help="how each test runs reproduce_bug: a new reproduction.py per test (default), "
+                             "in this process, or in one long-lived worker process per device")
+    parser.add_argument('--timeout', type=int, default=300, help="seconds allowed per test")
+    parser.add_argument('--reset', choices=('none', 'auto') + RESET_LEVELS, default='none',
+                        help="reset app state before each test: auto picks the cheapest clean level "
+                             "(clear data, emulator snapshot, reinstall); naming a level makes it the minimum")
+    parser.add_argument('--snapshots', action='store_true',
+                        help="the emulators are writable (emulator_pool.py up --writable): let resets save and "
+                             "load per-APK snapshots; required by --reset snapshot")
+    parser.add_argument('--trace', action='store_true',
+                        help="save a Chrome trace (chrome://tracing, Perfetto) of each test next to its events")
+    args = parser.parse_args()
+    if args.only_failures and not (args.resume or args.resume_latest):
+        parser.error("--only-failures needs --resume RESULTS_CSV or --resume-latest")
+    if args.reset == 'snapshot' and not args.snapshots:
+        parser.error("--reset snapshot needs writable emulators and --snapshots")
+    
+    results_file = None
+    if args.resume or args.resume_latest:
+        results_file = latest_results_file() if args.resume_latest else args.resume
+        if not results_file or not os.path.exists(results_file):
+            print(f"Error: no results file to resume ({args.resume or 'no test_results_*.csv found'})")
+            sys.exit(1)
     
-    device_port = sys.argv[1]
+    device_ports = args.device_ports
+    if device_ports == ['auto']:
+        device_ports = DevicePool.discover(os.path.expanduser("~/Library/Android/sdk/platform-tools/adb"))
+        if not device_ports:
+            print("Error: no running emulators found")
+            sys.exit(1)
     
+    tester = None
     try:
-        tester = IncrementalTester(device_port)
-        tester.run_all_tests()
+        tester = IncrementalTester(device_ports, results_file=results_file, headless=args.headless,
+                                   runner=args.runner, timeout=args.timeout, trace=args.trace,
+                                   reset=args.reset, snapshots=args.snapshots)
+        tester.run_all_tests(only_failures=args.only_failures)
     except KeyboardInterrupt:
         print("\n\nTesting interrupted by user")
-        print(f"Partial results saved to: {tester.results_file}")
+        if tester is not None:
+            print(f"Partial results saved to: {tester.results_file}")
     except Exception as e:
         print(f"\n✗ Fatal error: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if tester is not None:
+            tester.close()
 
 
 if __name__ == "__main__":
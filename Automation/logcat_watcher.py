@@ -0,0 +1,168 @@
+import re
+import time
+import threading
+import subprocess
+from collections import deque
+
+
+# logcat -v threadtime: "MM-DD HH:MM:SS.mmm  PID  TID L TAG: message"
+THREADTIME_PATTERN = re.compile(r'^\S+\s+\S+\s+(\d+)\s+(\d+)\s+([VDIWEFA])\s+(.*?)\s*: (.*)$')
+START_PROC_PATTERN = re.compile(r'Start proc (\d+):([^/\s]+)')
+PROCESS_PATTERN = re.compile(r'Process: ([^,\s]+), PID: (\d+)')
+ANR_PATTERN = re.compile(r'ANR in ([^\s(]+)')
+
+
+class LogcatWatcher:
+    """
+    Streams `adb logcat` for the whole session on a background thread.
+    Lines from the target package's processes (and crash/ANR reports) go to
+    a bounded ring buffer, and crashes and ANRs are recorded as they are
+    logged, so a crash check is a lookup instead of a full buffer dump.
+
+    The package's PIDs come from `pidof` at start and from ActivityManager's
+    "Start proc" lines, so restarts are followed. Without a package name
+    every fatal exception counts, like the old 'FATAL' substring check.
+    """
+
+    def __init__(self, device_port, package_name=None, adb_path='adb', maxlen=2000, on_event=None):
+        self.serial = f'emulator-{device_port}'
+        self.package_name = package_name
+        self.adb_path = adb_path
+        self.lines = deque(maxlen=maxlen)
+        self.events = []  # {'kind': 'crash' | 'anr', 'time', 'pid', 'line'}
+        self.pids = set()
+        self.crash_count = 0
+        self.anr_count = 0
+        self.on_event = on_event
+        self._pending_fatal = {}  # pid -> FATAL EXCEPTION line awaiting its "Process:" line
+        self._lock = threading.Lock()
+        self._process = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        if self.package_name:
+            self.refresh_pids()
+        # the session clears logcat first, so reading from the start of the
+        # buffers only sees this session
+        try:
+            self._process = subprocess.Popen(
+                [self.adb_path, '-s', self.serial, 'logcat', '-v', 'threadtime', '-b', 'main,system,crash'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors='replace', bufsize=1)
+        except OSError as e:
+            # not alive: check_crash keeps using logcat dumps
+            print(f"logcat watcher not started: {e}")
+            return self
+        self._thread = threading.Thread(target=self._run, name=f'logcat-{self.serial}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def refresh_pids(self):
+        try:
+            result = subprocess.run([self.adb_path, '-s', self.serial, 'shell', 'pidof', self.package_name],
+                                    capture_output=True, text=True, timeout=5)
+        except (subprocess.TimeoutExpired, OSError):
+            return
+        with self._lock:
+            self.pids.update(int(pid) for pid in result.stdout.split() if pid.isdigit())
+
+    def _run(self):
+        for line in self._process.stdout:
+            self.feed(line.rstrip('\n'))
+
+    def _is_target(self, package):
+        return self.package_name is None or package == self.package_name
+
+    def feed(self, line):
+        match = THREADTIME_PATTERN.match(line)
+        if match is None:
+            return
+        pid, level, tag, message = int(match.group(1)), match.group(3), match.group(4), match.group(5)
+
+        start = START_PROC_PATTERN.search(message) if tag == 'ActivityManager' else None
+        if start and self._is_target(start.group(2)):
+            with self._lock:
+                self.pids.add(int(start.group(1)))
+
+        ours = pid in self.pids
+        if tag == 'AndroidRuntime' and 'FATAL EXCEPTION' in message:
+            if ours or self.package_name is None:
+                self._record('crash', pid, line)
+                ours = True
+            else:
+                self._pending_fatal[pid] = line
+        elif tag == 'AndroidRuntime' and pid in self._pending_fatal:
+            process = PROCESS_PATTERN.search(message)
+            if process:
+                fatal = self._pending_fatal.pop(pid)
+                if self._is_target(process.group(1)):
+                    with self._lock:
+                        self.pids.add(pid)
+                        self.lines.append(fatal)
+                    self._record('crash', pid, fatal)
+                    ours = True
+        elif level == 'F' and 'Fatal signal' in message and (ours or self.package_name is None):
+            self._record('crash', pid, line)
+        elif tag == 'ActivityManager' and level == 'E':
+            anr = ANR_PATTERN.search(message)
+            if anr and self._is_target(anr.group(1)):
+                self._record('anr', pid, line)
+                ours = True
+
+        if ours or (self.package_name is None and level in 'EF'):
+            with self._lock:
+                self.lines.append(line)
+
+    def _record(self, kind, pid, line):
+        event = {'kind': kind, 'time': time.time(), 'pid': pid, 'line': line}
+        with self._lock:
+            self.events.append(event)
+            if kind == 'crash':
+                self.crash_count += 1
+            else:
+                self.anr_count += 1
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                pass
+
+    def has_crash(self):
+        return self.crash_count > 0
+
+    def has_anr(self):
+        return self.anr_count > 0
+
+    def recent_lines(self, n=100):
+        with self._lock:
+            return list(self.lines)[-n:]
+
+
+_watchers = {}
+
+def start_logcat_watcher(device_port, package_name=None, **kwargs):
+    watcher = _watchers.get(str(device_port))
+    if watcher is None:
+        watcher = _watchers[str(device_port)] = LogcatWatcher(device_port, package_name, **kwargs).start()
+    return watcher
+
+def get_logcat_watcher(device_port):
+    return _watchers.get(str(device_port))
+
+def stop_logcat_watcher(device_port):
+    watcher = _watchers.pop(str(device_port), None)
+    if watcher is not None:
+        watcher.stop()
@@ -3,56 +3,60 @@ import datetime
 import math
 import time 
 import json
+import hashlib
+import threading
 from utils import *
+from token_counter import *
+from response_cache import *
+from screen_diff import *
+from history_compactor import *
+from rate_limiter import *
 from dotenv import load_dotenv
+from session_state import *
 
 # Replace your key here 
 load_dotenv()
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
-def count_tokens(message):
-    # Approximate token count for Gemini (roughly 1 token per 4 characters)
-    return len(message) // 4
-
-def count_chat_history_tokens(chat_history):
-    total_tokens = 0
-    for message in chat_history:
-        total_tokens += count_tokens(message['content'])
-        total_tokens += count_tokens(message['role'])
-    
-    return total_tokens
-
-def truncate_message(message, n):
-    # Approximate truncation for Gemini
-    estimated_tokens = len(message) // 4
-    if estimated_tokens <= n:
-        return False, None
-    else:
-        # Truncate to approximate character count
-        char_limit = math.floor(n * 4)
-        truncated_message = message[:char_limit]
-        return True, truncated_message
-
-def process_history(prompt, history, max_tokens, threshold):
-    tokens_in_chat_history = count_chat_history_tokens(history)
+def process_history(prompt, history, max_tokens, threshold, deadline=None):
+    compactor = get_history_compactor()
+    if compactor is not None:
+        history = compactor.compact(history, max_tokens, deadline)
+    counter = get_token_counter()
+    tokens_in_chat_history = counter.sync(history)
+    limit = math.floor(max_tokens*threshold)
+    if tokens_in_chat_history > limit and compactor is not None:
+        # over the limit before the background summary caught up: summarize now
+        history = compactor.compact_now(history, limit, deadline)
+        tokens_in_chat_history = counter.sync(history)
    
-    if tokens_in_chat_history > math.floor(max_tokens*threshold):
+    if tokens_in_chat_history > limit:
         last_prompt_message = history[-1]['content'] 
-        if count_tokens(last_prompt_message ) > 4000:
-            del history[-1]
-            truncated, truncated_message = truncate_message(last_prompt_message, (max_tokens-count_chat_history_tokens(history))*threshold)
-            history.append({"role": "user", "content": truncated_message})
+        if counter.counts[-1] > 4000:
+            counter.pop(history)
+            truncated, truncated_message = truncate_message(last_prompt_message, (max_tokens-counter.total)*threshold)
+            history.append({"role": "user", "content": truncated_message if truncated else last_prompt_message})
         
         print('summarize==========================================')
         history.append({"role": "user", "content": 'The conversation is about to exceed the limit, before we continue the reproduction process. Can you summarize the above conversation. Note that You shouldn\'t summarize the rule and keep the rules as original since the rules are the standards.'})
         
         model = genai.GenerativeModel('models/gemini-2.5-pro')
         chat_text = convert_history_to_text(history)
-        response = model.generate_content(chat_text)
-        message = response.text
+
+        def summarize():
+            get_rate_limiter().acquire()
+            return model.generate_content(chat_text, request_options=request_options(deadline)).text
+        message = call_with_retry(summarize, deadline=deadline)
         print(message)
         history = load_training_prompts('./prompts/training_prompts_ori.json')
         history.append({"role": "user", "content": message})
+        # the summary replaces the bug report, so it joins the fixed prefix
+        if compactor is not None:
+            compactor.reset(len(history))
+        # the summary does not keep the screens a delta prompt refers to
+        encoder = get_screen_encoder()
+        if encoder is not None:
+            prompt = encoder.restore_full(prompt)
        
     history.append({"role": "user", "content": prompt})
   
@@ -72,42 +76,283 @@ def convert_history_to_text(history):
             text += f"Assistant: {content}\n\n"
     return text
 
-def generate_text(prompt, history, package_name=None, model_name="models/gemini-2.5-pro", max_tokens=128000, attempts = 3):
+GEMINI_ROLES = {'user': 'user', 'assistant': 'model', 'system': 'user'}
+
+# what a response is in structured mode: a list of commands, [{"result": ...}]
+# or [{"action": "check crash"}], as handle_command expects them
+COMMAND_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'action': {'type': 'string'},
+            'feature': {'type': 'string'},
+            'features': {'type': 'array', 'items': {'type': 'string'}},
+            'input_text': {'type': 'string'},
+            'direction': {'type': 'string'},
+            'to_direction': {'type': 'string'},
+            'target_direction': {'type': 'string'},
+            'orientation': {'type': 'string'},
+            'current_status': {'type': 'string'},
+            'target_status': {'type': 'string'},
+            'index': {'type': 'integer'},
+            'duration': {'type': 'number'},
+            # the final answer the training prompt asks for
+            'result': {'type': 'string', 'enum': ['success', 'fail']},
+            'reason': {'type': 'string'},
+            'bugreport': {'type': 'string'},
+        },
+    },
+}
+
+class ChatSession:
+    """
+    Long-lived model plus the chat history already converted to Gemini
+    multi-turn contents. Each turn only converts the messages appended since
+    the last call; the converted prefix is reused as long as the history list
+    it came from is only appended to.
+    """
+
+    def __init__(self, model_name="models/gemini-2.5-pro", temperature=0.3, structured=False):
+        self.model_name = model_name
+        self.temperature = temperature
+        # structured: the model must answer with JSON matching COMMAND_SCHEMA
+        self.structured = structured
+        if structured:
+            self.generation_config = genai.types.GenerationConfig(temperature=temperature, response_mime_type='application/json',
+                                                                  response_schema=COMMAND_SCHEMA)
+            self.cache_params = {'temperature': temperature, 'schema': COMMAND_SCHEMA}
+        else:
+            self.generation_config = genai.types.GenerationConfig(temperature=temperature)
+            self.cache_params = {'temperature': temperature}
+        # time.monotonic() by which the reproduction must stop; bounds requests and retries
+        self.deadline = None
+        self.model = None
+        self.system_instruction = None
+        self.contents = []
+        self.history = None
+        self.synced = 0
+        self._last_synced = None
+        self.digest = ''
+
+    def reset(self):
+        self.contents = []
+        self.history = None
+        self.synced = 0
+        self.digest = ''
+
+    def append_message(self, message):
+        role = GEMINI_ROLES.get(message['role'], 'user')
+        # chained hash of the normalized conversation, the response cache key
+        self.digest = hashlib.sha256(f"{self.digest}\x00{role}\x00{message['content'].strip()}".encode('utf-8')).hexdigest()
+        # Gemini expects alternating turns; consecutive messages from the same
+        # side become parts of one turn.
+        if self.contents and self.contents[-1]['role'] == role:
+            self.contents[-1]['parts'].append(message['content'])
+        else:
+            self.contents.append({'role': role, 'parts': [message['content']]})
+
+    def sync(self, history):
+        # history was replaced (e.g. after summarization) or rewritten: rebuild
+        if history is not self.history or len(history) < self.synced \
+                or (self.synced and history[self.synced - 1] is not self._last_synced):
+            self.reset()
+            self.history = history
+            system_instruction = None
+            if history and history[0]['role'] == 'system':
+                system_instruction = history[0]['content']
+                self.digest = hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()
+                self.synced = 1
+            if self.model is None or system_instruction != self.system_instruction:
+                self.system_instruction = system_instruction
+                self.model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+
+        for message in history[self.synced:]:
+            self.append_message(message)
+        self.synced = len(history)
+        self._last_synced = history[-1] if history else None
+        return self.contents
+
+    def generate(self, history):
+        """Response text for the conversation, served from the response cache when enabled."""
+        contents = self.sync(history)
+        cache = get_response_cache()
+        if cache is not None:
+            key = cache.make_key(self.model_name, self.cache_params, self.digest)
+            text = cache.get(key)
+            if text is not None:
+                return text
+            if cache.replay_only:
+                raise ResponseCacheMiss(f"No recorded response for this conversation ({key[:12]})")
+
+        get_rate_limiter().acquire()
+        text = self.model.generate_content(contents, generation_config=self.generation_config,
+                                           request_options=request_options(self.deadline)).text
+        if cache is not None:
+            cache.put(key, self.model_name, text)
+        return text
+
+    def generate_stream(self, history, on_text):
+        """Like generate, calling on_text(text so far) as the response streams in."""
+        contents = self.sync(history)
+        cache = get_response_cache()
+        if cache is not None:
+            key = cache.make_key(self.model_name, self.cache_params, self.digest)
+            text = cache.get(key)
+            if text is not None:
+                on_text(text)
+                return text
+            if cache.replay_only:
+                raise ResponseCacheMiss(f"No recorded response for this conversation ({key[:12]})")
+
+        get_rate_limiter().acquire()
+        text = ''
+        for chunk in self.model.generate_content(contents, generation_config=self.generation_config, stream=True,
+                                                 request_options=request_options(self.deadline)):
+            try:
+                text += chunk.text
+            except ValueError:
+                continue  # a chunk without a text part, e.g. only finish metadata
+            on_text(text)
+        if not text:
+            raise ValueError("The streamed response has no text")
+        if cache is not None:
+            cache.put(key, self.model_name, text)
+        return text
+
+
+_session_chat = session_local()
+
+def get_chat_session(model_name="models/gemini-2.5-pro"):
+    session = _session_chat.get()
+    if session is None or session.model_name != model_name:
+        session = _session_chat.set(ChatSession(model_name))
+    return session
+
+def set_chat_session(session):
+    return _session_chat.set(session)
+
+@traced('llm')
+def generate_text(prompt, history, package_name=None, model_name="models/gemini-2.5-pro", max_tokens=128000, policies=RETRY_POLICIES, session=None):
     
-    history = process_history(prompt, history, max_tokens, threshold = 0.75)
+    if session is None:
+        session = get_chat_session(model_name)
+    history = process_history(prompt, history, max_tokens, threshold = 0.75, deadline=session.deadline)
+
+    def on_failure(e, attempt):
+        if package_name is not None:
+            save_chat_history(history, package_name)
+
+    text = call_with_retry(lambda: session.generate(history), policies, on_failure, no_retry=ResponseCacheMiss,
+                           deadline=session.deadline)
+    # Create a response object similar to OpenAI format
+    formatted_response = {
+        "model": model_name,
+        "choices": [{"message": {"content": text}}]
+    }
+    return formatted_response, history
+
+
+
+
+class StreamingResponse:
+    """
+    A response streamed on a background thread. commands() returns as soon
+    as the first complete command list has arrived, so execution can start
+    while the rest of the response is still coming; message() waits for
+    the whole text, which is what goes into the history. Until commands()
+    has taken an early list, a retried request starts its scan over, so
+    the commands run and the message recorded come from the same response.
+    """
 
-    for times in range(attempts):  # retry up to 3 times
+    def __init__(self, session, history, policies=RETRY_POLICIES, on_failure=None):
+        self.session = session
+        self.history = history
+        self.scanner = CommandListScanner()
+        self.text = ''
+        self.error = None
+        self.taken = False  # commands() returned the early command list
+        self.early = False  # commands() returned before the response was complete
+        self.saved = False  # the full response only parsed thanks to parse_command_list
+        self.first_commands_seconds = None
+        self.seconds = None
+        self.found = threading.Event()
+        self.done = threading.Event()
+        self.lock = threading.Lock()  # taken vs. a retry resetting the scan
+        # the stream thread reports retries and backoff to the caller's session
+        self.event_log = get_event_log()
+        self.tracer = get_tracer()
+        self.start = time.monotonic()
+        self.thread = threading.Thread(target=self.run, args=(policies, on_failure), daemon=True)
+        self.thread.start()
+
+    def on_text(self, text):
+        self.text = text
+        if not self.found.is_set() and self.scanner.feed(text) is not None:
+            self.first_commands_seconds = time.monotonic() - self.start
+            self.found.set()
+
+    def attempt(self):
+        with self.lock:
+            if not self.taken:
+                self.scanner = CommandListScanner()
+                self.first_commands_seconds = None
+                self.found.clear()
+        try:
+            return self.session.generate_stream(self.history, self.on_text)
+        except Exception:
+            # commands from this response may already be running: keep what arrived
+            if self.taken:
+                print("The response stream broke off after its commands arrived; keeping the partial text")
+                return self.text
+            raise
+
+    def run(self, policies, on_failure):
+        set_event_log(self.event_log)
+        set_tracer(self.tracer.for_thread())
         try:
-            model = genai.GenerativeModel(model_name)
-            chat_text = convert_history_to_text(history)
-            
-            response = model.generate_content(
-                chat_text,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.3,
-                )
-            )
-            
-            # Create a response object similar to OpenAI format
-            formatted_response = {
-                "model": model_name,
-                "choices": [{"message": {"content": response.text}}]
-            }
-            return formatted_response, history
+            self.text = call_with_retry(self.attempt, policies, on_failure, no_retry=ResponseCacheMiss,
+                                        deadline=self.session.deadline)
         except Exception as e:
-            print(f"Attempt {times + 1} failed with error: {str(e)}")
-            if times < 2: 
-                if package_name is not None:
-                    save_chat_history(history, package_name)
-                print(f"Take a 60*{times+1} seconds break before the next attempt...")
-                time.sleep(60*(times+1)) 
-            else: 
-                print(f"All {attempts} attempts failed. Please try again later.")
-                if package_name is not None:
-                    save_chat_history(history, package_name)
-                raise e
+            self.error = e
+        finally:
+            self.seconds = time.monotonic() - self.start
+            self.done.set()
+            self.found.set()
+
+    def commands(self):
+        """The first complete command list, or the full response parsed once the stream ended."""
+        while True:
+            self.found.wait()
+            with self.lock:
+                if self.scanner.command_list is not None:
+                    self.taken = True
+                    self.early = not self.done.is_set()
+                    return self.scanner.command_list
+                if self.done.is_set():
+                    break
+        command_list, _, self.saved = parse_command_list(self.message())
+        return command_list
+
+    def message(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+@traced('llm')
+def stream_text(prompt, history, package_name=None, model_name="models/gemini-2.5-pro", max_tokens=128000, policies=RETRY_POLICIES, session=None):
+    """generate_text, but returns a StreamingResponse instead of waiting for the response."""
+    if session is None:
+        session = get_chat_session(model_name)
+    history = process_history(prompt, history, max_tokens, threshold = 0.75, deadline=session.deadline)
 
+    def on_failure(e, attempt):
+        if package_name is not None:
+            save_chat_history(history, package_name)
 
+    return StreamingResponse(session, history, policies, on_failure), history
 
 
 def save_chat_history(history, package_name):
@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import time
+import fcntl
+import random
+import tempfile
+from tracing import *
+from event_log import *
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits up to min(cap, base * 2**n) seconds."""
+
+    def __init__(self, max_attempts, base=1.0, cap=60.0):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        # the server's hint is a floor, jitter still spreads the workers out
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, 1))
+        return delay
+
+
+RETRY_POLICIES = {
+    'rate_limit': RetryPolicy(max_attempts=6, base=4.0, cap=120.0),  # 429, quota
+    'server': RetryPolicy(max_attempts=4, base=2.0, cap=60.0),       # 5xx, timeouts, connection errors
+    'malformed': RetryPolicy(max_attempts=2, base=0.5, cap=2.0),     # empty or blocked response
+    'client': RetryPolicy(max_attempts=1),                          # 4xx: retrying cannot help
+    'unknown': RetryPolicy(max_attempts=3, base=2.0, cap=60.0),
+}
+
+
+def classify_error(e):
+    code = getattr(e, 'code', None)
+    if not isinstance(code, int):
+        code = getattr(getattr(e, 'response', None), 'status_code', None)
+    if code == 429:
+        return 'rate_limit'
+    if isinstance(code, int) and code >= 500:
+        return 'server'
+    if isinstance(code, int) and 400 <= code < 500:
+        return 'client'
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return 'server'
+    # response.text raises ValueError when the candidate has no text part
+    if isinstance(e, ValueError):
+        return 'malformed'
+    return 'unknown'
+
+
+RETRY_AFTER_PATTERNS = (re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)'),
+                        re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE))
+
+def retry_after(e):
+    """Seconds the server asked us to wait, if it said."""
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    if headers.get('Retry-After', '').strip().isdigit():
+        return float(headers['Retry-After'])
+    for detail in getattr(e, 'details', None) or []:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(str(e))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class SharedRateLimiter:
+    """
+    Token bucket for LLM requests shared by every process on the host, kept
+    in a small JSON file under an exclusive flock. requests_per_minute None
+    only shares the cool-down: after a 429 with Retry-After, every worker
+    holds off until it has passed instead of each tripping the quota again.
+    The file is replaced atomically, so checking the cool-down is a plain
+    read; only taking tokens and cool_down lock and write it.
+    """
+
+    def __init__(self, path, requests_per_minute=None, burst=None):
+        self.path = path
+        self.rate = requests_per_minute / 60 if requests_per_minute else None
+        self.capacity = burst or max(1, (requests_per_minute or 0) // 6)
+        self.waited = 0.0
+
+    def update(self, fn):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self.read()
+                result = fn(state, time.time())
+                temp = f'{self.path}.{os.getpid()}.tmp'
+                with open(temp, 'w') as f:
+                    json.dump(state, f)
+                os.replace(temp, self.path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def take(self, state, now, cost):
+        """Seconds to wait before retrying, or 0 once cost tokens were taken."""
+        if state.get('blocked_until', 0) > now:
+            return state['blocked_until'] - now
+        if self.rate is None:
+            return 0
+        tokens = min(self.capacity, state.get('tokens', self.capacity) + (now - state.get('updated', now)) * self.rate)
+        state['updated'] = now
+        if tokens >= cost:
+            state['tokens'] = tokens - cost
+            return 0
+        state['tokens'] = tokens
+        return (cost - tokens) / self.rate
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def acquire(self, cost=1):
+        while True:
+            if self.rate is None:
+                wait = self.read().get('blocked_until', 0) - time.time()
+            else:
+                wait = self.update(lambda state, now: self.take(state, now, cost))
+            if wait <= 0:
+                return
+            self.waited += wait
+            with get_tracer().span('llm.rate_limit', 'sleep'):
+                time.sleep(wait)
+
+    def cool_down(self, seconds):
+        """Make every worker wait seconds before its next request."""
+        def block(state, now):
+            state['blocked_until'] = max(state.get('blocked_until', 0), now + seconds)
+        self.update(block)
+
+
+_limiter = None
+
+def request_options(deadline):
+    """generate_content request_options bounding the request by deadline (time.monotonic())."""
+    if deadline is None:
+        return None
+    return {'timeout': max(deadline - time.monotonic(), 1.0)}
+
+
+def get_rate_limiter():
+    """The host-wide limiter configured by $REBL_LLM_RPM and $REBL_LLM_RATE_FILE."""
+    global _limiter
+    if _limiter is None:
+        rpm = os.getenv('REBL_LLM_RPM')
+        path = os.getenv('REBL_LLM_RATE_FILE') or os.path.join(tempfile.gettempdir(), 'rebl_llm_rate.json')
+        _limiter = SharedRateLimiter(path, int(rpm) if rpm else None)
+    return _limiter
+
+def set_rate_limiter(limiter):
+    global _limiter
+    _limiter = limiter
+    return limiter
+
+
+def call_with_retry(fn, policies=RETRY_POLICIES, on_failure=None, no_retry=(), deadline=None):
+    """
+    fn() retried according to the policy of each error's class. on_failure(e,
+    attempt) runs after every failed attempt; exceptions in no_retry are
+    raised at once. No retry is started that would end past deadline
+    (time.monotonic()).
+    """
+    attempts = {}
+    while True:
+        try:
+            return fn()
+        except no_retry:
+            raise
+        except Exception as e:
+            error_class = classify_error(e)
+            attempt = attempts[error_class] = attempts.get(error_class, 0) + 1
+            policy = policies[error_class]
+            if on_failure is not None:
+                on_failure(e, attempt)
+            if attempt >= policy.max_attempts:
+                print(f"Giving up after {attempt} {error_class} failure(s): {e}")
+                raise
+            hint = retry_after(e)
+            delay = policy.delay(attempt - 1, hint)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                print(f"Giving up after {attempt} {error_class} failure(s): no time left to retry: {e}")
+                raise
+            if error_class == 'rate_limit':
+                get_rate_limiter().cool_down(delay)
+            print(f"LLM call failed ({error_class}, attempt {attempt}): {e}; retrying in {delay:.1f}s")
+            get_event_log().emit('llm_retry', delay, error_class=error_class, attempt=attempt,
+                                 retry_after=hint, message=str(e)[:200])
+            with get_tracer().span('llm.backoff', 'sleep', error_class=error_class):
+                time.sleep(delay)
@@ -1,4 +1,5 @@
 import sys
+import threading
 from datetime import datetime
 from collections import defaultdict
 import uiautomator2 as u2
@@ -8,19 +9,32 @@ from my_gpt import *
 from utils import *
 from bug_validation import *
 from handle_command import *
+from snapshot import *
+from wait_policy import *
+from event_log import *
+from tracing import *
+from logcat_watcher import *
+from session_tape import *
 
 def get_prompt(device, attribute_to_element_map, package_name, execution_status, flags):
     bug_report, need_hint, is_not_completet, repeating_commands = flags
-    widget_dict_1, info_1 = get_screen_information(device, attribute_to_element_map, package_name)
-    time.sleep(2)
-    attribute_to_element_map_2 = defaultdict(list)
-    widget_dict_2, info_2 = get_screen_information(device, attribute_to_element_map_2, package_name)
- 
-    if widget_dict_1 == widget_dict_2:
-        info = info_2
-        attribute_to_element_map = attribute_to_element_map_2
-    else:
-        info = f"There are a UI quickly disappear(less than 0.5s) after {execution_status}. The UI information of the page is {{info_1}}. If the next action related to the quick diappear page, Please provide a seris of actions to tigger the quick disappear UI then execute actions on the relevant transient widget in one go. Current page is {info_2}.  It the quick diappear UI is not related, we can ignore it and proceeed based on the state of current page"
+    tree, transient_tree = get_wait_policy().settle(device)
+    get_session_tape().screen(device, tree)
+    encoder = get_screen_encoder()
+    if encoder is not None and need_hint:
+        encoder.request_full()
+    widget_dict, info = get_screen_information(device, attribute_to_element_map, package_name, tree, delta=True)
+
+    if transient_tree is not None:
+        transient_widget_dict, transient_info = get_screen_information(device, defaultdict(list), package_name, transient_tree)
+        if transient_widget_dict != widget_dict:
+            if encoder is not None:
+                info = encoder.restore_full(info)
+            info = f"There are a UI quickly disappear(less than 0.5s) after {execution_status}. The UI information of the page is {transient_info}. If the next action related to the quick diappear page, Please provide a seris of actions to tigger the quick disappear UI then execute actions on the relevant transient widget in one go. Current page is {info}.  It the quick diappear UI is not related, we can ignore it and proceeed based on the state of current page"
+    # the toast is in this prompt; later turns only report newer ones
+    collector = get_toast_collector(device)
+    if collector is not None:
+        collector.consume()
     if need_hint:
         hint = "Your suggestion is None. Let's go back or restart"
         prompt = f"{hint}. {info}"
@@ -38,15 +52,31 @@ def get_prompt(device, attribute_to_element_map, package_name, execution_status,
         prompt = f"{execution_status}.{info}"
 
    
-    return widget_dict_2, prompt
+    return widget_dict, prompt, ScreenSnapshot(tree, attribute_to_element_map)
 
-def execute_commands(command_list, device, widget_dict, attribute_to_element_map, package_name):
+def record_response(model_name, message, history):
+    get_session_tape().response(model_name, message)
+    print(model_name)
+    print('###############################################\n')
+    print(f"*GPT message: {message}")
+    print('\n###############################################')
+    history.append({"role": "assistant", "content": message})
+
+def execute_commands(command_list, device, widget_dict, attribute_to_element_map, package_name, snapshot=None):
     if command_list is  None:
         return "No sugggestion"
     execution_status = []
-    for command in  command_list:  
+    collector = get_toast_collector(device)
+    if collector is not None:
+        collector.mark()
+    policy = get_wait_policy()
+    events = get_event_log()
+    tape = get_session_tape()
+    for i, command in  enumerate(command_list):  
+        start = time.monotonic()
+        status = None
         try:
-            status = handle_command(command, device, attribute_to_element_map, package_name)
+            status = handle_command(command, device, attribute_to_element_map, package_name, snapshot)
             if status == True :
                 if command['action'] in ['swipe']:
                     execution_status.append(f"Successfully execute {command} but please make sure you swipe to the correct location, if not either keep swiping or change the from_direction and to_direction. And keep in mind that swiping betwwen multi-page layout, one swipe is just going to the next layout ")
@@ -59,90 +89,253 @@ def execute_commands(command_list, device, widget_dict, attribute_to_element_map
                 execution_status.append(status)
         except Exception as e:
             execution_status.append(f"Failed to execute {command}. Error message: {e}")
+        tape.command(command, status)
+        events.emit('command', time.monotonic() - start, index=i, action=command.get('action') if isinstance(command, dict) else None,
+                    command=command, status=status, feedback=execution_status[-1])
+        if snapshot is not None:
+            snapshot.stale = True
 
-
-        time.sleep(0.5)
+        # the last command is followed by get_prompt's own settle detection
+        if i < len(command_list) - 1:
+            tape.idle(device, policy.wait_for_idle(device, 'command'))
     return execution_status
 
-def reproduce_bug(device_port, reprot_file_name): 
+# u2 connections reused across reproductions run by the same process
+_devices = {}
+_devices_lock = threading.Lock()
+
+def connect_device(device_port):
+    """The process's connection to emulator-<device_port>, reconnected if the device stopped answering."""
+    serial = f"emulator-{device_port}"
+    with _devices_lock:
+        device = _devices.get(serial)
+        if device is not None:
+            try:
+                device.info
+            except Exception as e:
+                print(f"Reconnecting to {serial}: {e}")
+                device = None
+        if device is None:
+            device = _devices[serial] = u2.connect(serial)
+        return device
+
+
+def reproduce_bug(device_port, reprot_file_name, max_seconds=None, events_path=None, trace_path=None,
+                  record_path=None, device=None, chat_session=None, tape=None, delta_prompts=None,
+                  compact_history=None, stream_responses=None, structured_output=None):
+    """
+    Reproduce one bug report on emulator-<device_port>. Returns a result dict
+    (bug_reproduced, timed_out, gpt_responses, total_commands, duration, ...).
+    max_seconds bounds the loop for callers running many reproductions in
+    one process: no step starts after it, and LLM requests, their retries
+    and a blocking history summary are cut to the time left. A device
+    action under way can still overrun it; only the reproduction.py and
+    worker process runners of incremental_test.py kill a test at --timeout.
+    With events_path every step is also written there as JSON
+    Lines (see event_log.py); with trace_path (or $REBL_TRACE) the run's
+    spans are exported there as a Chrome trace (see tracing.py).
+    With record_path (or $REBL_RECORD) every step is saved as a session tape
+    (see session_tape.py). fake_device.replay passes a FakeDevice, a replaying
+    chat session and the tape instead; no adb is used then.
+    With delta_prompts (or $REBL_DELTA_PROMPTS=1) screens of the same
+    activity are described by what changed since the previous turn (see
+    screen_diff.py). Older turns are summarized in the background once the
+    history grows (see history_compactor.py) unless compact_history is
+    False or $REBL_COMPACT_HISTORY=0. With stream_responses (or
+    $REBL_STREAM=1) commands start running as soon as the streamed response
+    contains a complete command list. With structured_output (or
+    $REBL_STRUCTURED=1) the model must answer with JSON matching
+    COMMAND_SCHEMA; every response goes through the tolerant
+    parse_command_list either way.
+    """
    
-    device = u2.connect(f"emulator-{device_port}")
-    clear_logcat(device_port)
+    trace_path = trace_path or os.getenv('REBL_TRACE')
+    tracer = set_tracer(Tracer(enabled=bool(trace_path)))
+    session_span = tracer.span('reproduce_bug', 'session', device=f"emulator-{device_port}").start()
+    step_span = NULL_SPAN
+    record_path = record_path or os.getenv('REBL_RECORD')
+    if tape is None:
+        tape = SessionTape('record', meta={'bug_report': reprot_file_name}) if record_path else NULL_TAPE
+    set_session_tape(tape)
+    offline = device is not None
+    events = set_event_log(EventLog(events_path))
+    events.emit('session_start', device=f"emulator-{device_port}", bug_report=reprot_file_name, max_seconds=max_seconds)
+    compactor = set_history_compactor(None)
+    try:
+        if not offline:
+            device = connect_device(device_port)
+            clear_logcat(device_port)
 
-    device.set_orientation("natural")
-    package_name = device.app_current()['package']
-    bug_report = read_bug_report(reprot_file_name)
+        device.set_orientation("natural")
+        package_name = device.app_current()['package']
+        if not offline:
+            start_toast_collector(device)
+            start_logcat_watcher(device_port, package_name,
+                                 on_event=lambda event: events.emit(event['kind'], pid=event['pid'], line=event['line']))
+        policy = set_wait_policy(WaitPolicy())
+        if structured_output is None:
+            structured_output = os.getenv('REBL_STRUCTURED') == '1'
+        chat_session = set_chat_session(chat_session or ChatSession(structured=structured_output))
+        if delta_prompts is None:
+            delta_prompts = os.getenv('REBL_DELTA_PROMPTS') == '1'
+        encoder = set_screen_encoder(ScreenDiffEncoder() if delta_prompts else None)
+        bug_report = read_bug_report(reprot_file_name)
 
-    history = load_training_prompts('./prompts/training_prompts_ori.json')
+        history = load_training_prompts('./prompts/training_prompts_ori.json')
     
 
 
   
     
-    #print(br_content)
-    #history.append({"role": "user", "content": br_content})
-    history.append({"role": "user", "content": f"{bug_report}"})
-    execution_data = [datetime.now(), 0, 0] # current time, num response, num commands
-    flags = [None, False, False, None] # bug_report, need_hint, is_not_completet, repeating_commands
-    crash = False
-    widget_dict, other_text, prompt = None, None, None
-    executed_commands, execution_status = [], []
-    
-    # here the variabel name should be bug_triggered
-    while not crash:
-        attribute_to_element_map = defaultdict(list) # for current page 
-        widget_dict, prompt = get_prompt(device, attribute_to_element_map, package_name, execution_status, flags)
-        
-        print(f"*Prompt: {prompt}") 
-        response,  history = generate_text(prompt, history, package_name)
-        message = get_message(response)
-        print(get_model_name(response))
-        print('###############################################\n')
-        print(f"*GPT message: {message}")
-        print('\n###############################################')
-
-        command_list = convert_message_to_command_list(message)
-        count_command_and_response(execution_data, command_list)
-        history.append({"role": "assistant", "content": message})  
-        
-        if command_list == []:
-            flags[1] = True
-            device.set_orientation("natural")
-            time.sleep(2)
-        elif command_list and isinstance(command_list[0], dict) and command_list[0].get('result', None) is not None:
-            #if command_list[0].get('result') == 'success':
-            if command_list[0].get('result'):
-                crash = True # here the variabel name should be bug_triggered
+        #print(br_content)
+        #history.append({"role": "user", "content": br_content})
+        history.append({"role": "user", "content": f"{bug_report}"})
+        if stream_responses is None:
+            stream_responses = os.getenv('REBL_STREAM') == '1'
+        if compact_history is None:
+            compact_history = os.getenv('REBL_COMPACT_HISTORY') != '0'
+        if compact_history:
+            # the rules, examples and bug report are never summarized
+            compactor = set_history_compactor(HistoryCompactor(prefix_len=len(history)))
+        execution_data = [datetime.now(), 0, 0] # current time, num response, num commands
+        flags = [None, False, False, None] # bug_report, need_hint, is_not_completet, repeating_commands
+        crash = False
+        timed_out = False
+        deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+        chat_session.deadline = deadline
+        widget_dict, other_text, prompt = None, None, None
+        executed_commands, execution_status = [], []
+        saved_round_trips = 0  # malformed responses recovered instead of re-prompting
+
+        # here the variabel name should be bug_triggered
+        while not crash:
+            step_span.finish()
+            if deadline is not None and time.monotonic() > deadline:
+                timed_out = True
+                break
+            tracer.step = execution_data[1] + 1
+            step_span = tracer.span('step', 'step').start()
+            attribute_to_element_map = defaultdict(list) # for current page 
+            with events.timed('prompt') as info:
+                widget_dict, prompt, snapshot = get_prompt(device, attribute_to_element_map, package_name, execution_status, flags)
+                info.update(prompt=prompt, screen=snapshot.fingerprint, widgets=len(widget_dict),
+                            delta=encoder is not None and encoder.sent != encoder.full)
+            
+            print(f"*Prompt: {prompt}") 
+            with events.timed('llm_response') as info:
+                if stream_responses:
+                    # commands run as soon as their list is complete; the rest
+                    # of the response is recorded once it has streamed in
+                    stream, history = stream_text(prompt, history, package_name)
+                    command_list = stream.commands()
+                    info.update(model=stream.session.model_name, early=stream.early)
+                else:
+                    response,  history = generate_text(prompt, history, package_name)
+                    message = get_message(response)
+                    info.update(model=get_model_name(response), message=message)
+                    record_response(get_model_name(response), message, history)
+                    command_list, parse_method, saved = parse_command_list(message)
+                    saved_round_trips += saved
+            count_command_and_response(execution_data, command_list)
+            if stream_responses:
+                events.emit('commands', commands=command_list)
             else:
+                events.emit('commands', commands=command_list, parse=parse_method, saved=saved)
+            
+            if command_list == []:
                 flags[1] = True
-        elif command_list and isinstance(command_list[0], dict) and command_list[0].get('action', '') == 'check crash':
-            crash = check_crash(reprot_file_name, history, package_name, device_port, execution_data)
-            if not crash:
-                time.sleep(1)
-                crash = check_error_keywords(get_current_hierarchy(device), package_name) \
-                        or 'crashreport' in device.app_current()['activity'].lower()
+                device.set_orientation("natural")
+            elif command_list and isinstance(command_list[0], dict) and command_list[0].get('result', None) is not None:
+                # 'success' as the prompt asks, or True; 'fail' means not triggered
+                if str(command_list[0].get('result')).lower() in ('success', 'true'):
+                    crash = True # here the variabel name should be bug_triggered
+                else:
+                    flags[1] = True
+            elif command_list and isinstance(command_list[0], dict) and command_list[0].get('action', '') == 'check crash':
+                with events.timed('crash_check') as info:
+                    crash = info['logcat'] = tape.observe('logcat_crash', lambda: check_crash(device_port))
+                    if not crash:
+                        tree = get_wait_policy().wait_for_idle(device, 'check_crash')
+                        crash = check_error_keywords(tree, package_name) \
+                                or 'crashreport' in device.app_current()['activity'].lower()
+                    info['crash'] = crash
                 if not crash:
                     flags[2] = True   
-        else:
-            execution_status = execute_commands(command_list, device, widget_dict, attribute_to_element_map, package_name)
-            flags[3] = add_commands(executed_commands, command_list)
-        #if not crash:
-        #    crash = check_crash(reprot_file_name, history, package_name, device_port, execution_data)
+            else:
+                execution_status = execute_commands(command_list, device, widget_dict, attribute_to_element_map, package_name, snapshot)
+                flags[3] = add_commands(executed_commands, command_list)
+            if stream_responses:
+                with events.timed('llm_stream_end') as info:
+                    message = stream.message()
+                    # the original parser would have failed on this response
+                    saved = stream.saved or (stream.taken and
+                                             not is_command_list(convert_message_to_command_list(message, verbose=False)))
+                    saved_round_trips += saved
+                    info.update(message=message, early=stream.early, first_commands_seconds=stream.first_commands_seconds,
+                                stream_seconds=stream.seconds, saved=saved)
+                record_response(stream.session.model_name, message, history)
+            #if not crash:
+            #    crash = check_crash(reprot_file_name, history, package_name, device_port, execution_data)
+    except Exception as e:
+        events.emit('error', message=f"{type(e).__name__}: {e}")
+        events.close()
+        raise
+    finally:
+        if device is not None and not offline:
+            stop_toast_collector(device)
+            stop_logcat_watcher(device_port)
+        if compactor is not None:
+            compactor.close()
+        step_span.finish()
+        tracer.step = None
+        session_span.finish()
+        if tracer.enabled:
+            tracer.export_chrome_trace(trace_path)
+            print(format_trace_summary(tracer.events))
+            print(f"Trace saved to: {trace_path}")
     start_time, response_time, total_commands = execution_data
     log_and_save_history(reprot_file_name, start_time, response_time, total_commands, history, package_name, 'xxx')
+    print(policy.format_summary())
+    if encoder is not None:
+        print(encoder.format_summary())
+    if compactor is not None:
+        print(compactor.format_summary())
+    print(f"Malformed responses recovered: {saved_round_trips} (LLM round trips saved)")
+    cache = get_response_cache()
+    if cache is not None:
+        print(f"LLM response cache: {cache.stats()}")
     device.set_orientation("natural")
+
+    result = {
+        'bug_reproduced': crash,
+        'timed_out': timed_out,
+        'gpt_responses': response_time,
+        'total_commands': total_commands,
+        'duration': (datetime.now() - start_time).total_seconds(),
+        'package_name': package_name,
+        'failure_reason': f'Stopped after {max_seconds} seconds' if timed_out else '',
+        'log_file': events_path or '',
+        'saved_round_trips': saved_round_trips,
+    }
+    events.emit('result', **result)
+    if tape.recording:
+        tape.data['result'] = result
+        tape.save(record_path)
+        print(f"Session recorded to: {record_path}")
+    events.close()
+    return result
     
 
 
-def main(device_port, reprot_file_name):
-    reproduce_bug(device_port, reprot_file_name)
+def main(device_port, reprot_file_name, events_path=None):
+    reproduce_bug(device_port, reprot_file_name, events_path=events_path)
 
 if __name__ == "__main__":
     if len(sys.argv) == 2: 
         print_screen_information_testing(f"emulator-{sys.argv[1]}")
-    elif len(sys.argv) == 3:
-        main(sys.argv[1] , sys.argv[2]) #device_id, reprot_file_name
+    elif len(sys.argv) in (3, 4):
+        main(*sys.argv[1:]) #device_id, reprot_file_name[, events_file]
     else:
-        print("Usage: python3 script.py <device_port> <file_name>")
+        print("Usage: python3 script.py <device_port> <file_name> [events.jsonl]")
 
     
\ No newline at end of file
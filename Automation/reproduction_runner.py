@@ -0,0 +1,83 @@
+import os
+import traceback
+import multiprocessing
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_reproduction(device_port, br_path, max_seconds=None, events_path=None, trace_path=None):
+    """
+    Run reproduce_bug in the calling process. Returns (result, return_code)
+    with the same meaning as a reproduction.py child: 0 on a clean run, 1
+    when it raised. Like that child it runs in this directory: reproduce_bug
+    reads ./prompts, writes ./chat_history and takes br_path relative to it.
+    """
+    os.chdir(SCRIPT_DIR)
+    # imported on first use, then shared by every test of this process
+    from reproduction import reproduce_bug
+    try:
+        return reproduce_bug(device_port, br_path, max_seconds=max_seconds,
+                             events_path=events_path, trace_path=trace_path), 0
+    except Exception as e:
+        traceback.print_exc()
+        return {'bug_reproduced': False, 'timed_out': False, 'failure_reason': str(e)[:100]}, 1
+
+
+def _worker_loop(conn, device_port):
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        conn.send(run_reproduction(device_port, *job))
+
+
+class ReproductionWorker:
+    """
+    A long-lived child process for one device. The Gemini, uiautomator2 and
+    pandas imports and the device connection are paid once, not per test.
+    A test that overruns its timeout gets the process killed and replaced.
+    """
+
+    def __init__(self, device_port):
+        self.device_port = device_port
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        # spawn: a fresh interpreter, not a fork of the threaded tester
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_loop, args=(child_conn, self.device_port),
+                                       name=f'reproduction-{self.device_port}', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, br_path, timeout, max_seconds=None, events_path=None, trace_path=None):
+        """(result, return_code); None if the test did not finish within timeout."""
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.conn.send((br_path, max_seconds, events_path, trace_path))
+        if not self.conn.poll(timeout):
+            self.kill()
+            return None
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            # the child died mid-test (e.g. a native crash)
+            code = self.process.exitcode
+            self.kill()
+            return {'bug_reproduced': False, 'timed_out': False,
+                    'failure_reason': f'Worker process exited with code {code}'}, code or 1
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+        self.process = None
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(10)
+        self.kill()
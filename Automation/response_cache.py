@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class ResponseCacheMiss(Exception):
+    """Raised in replay-only mode when a prompt has no recorded response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed LLM response cache in SQLite. The key is a hash of the
+    model name, generation config and conversation, so re-running a BR
+    against the same APK replays identical turns without calling the API.
+
+    mode: 'readwrite' (default) or 'replay' (never call the API; misses raise).
+    """
+
+    def __init__(self, path, mode='readwrite', ttl=None, max_entries=10000):
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # shared by the threads of one process; sqlite's file locking covers
+        # separate worker processes
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            created REAL,
+            last_access REAL,
+            hits INTEGER DEFAULT 0)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)')
+        self.conn.commit()
+
+    @property
+    def replay_only(self):
+        return self.mode == 'replay'
+
+    @staticmethod
+    def make_key(model_name, generation_config, conversation_digest):
+        payload = json.dumps([model_name, generation_config, conversation_digest], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model_name, response):
+        now = time.time()
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, model, response, created, last_access, hits) '
+                              'VALUES (?, ?, ?, ?, ?, 0)', (key, model_name, response, now, now))
+            self.stores += 1
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # least recently used entries beyond max_entries
+        if self.max_entries is None:
+            return
+        self.conn.execute('DELETE FROM responses WHERE key IN '
+                          '(SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                          (self.max_entries,))
+
+    def stats(self):
+        with self._lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+_cache = None
+_cache_configured = False
+
+def get_response_cache():
+    """
+    The process-wide cache configured from the environment, or None:
+      LLM_CACHE_PATH         sqlite file; caching is off when unset
+      LLM_CACHE_MODE         readwrite | replay
+      LLM_CACHE_TTL          seconds before an entry expires
+      LLM_CACHE_MAX_ENTRIES  LRU bound (default 10000)
+    """
+    global _cache, _cache_configured
+    if not _cache_configured:
+        _cache_configured = True
+        path = os.getenv('LLM_CACHE_PATH')
+        if path:
+            ttl = os.getenv('LLM_CACHE_TTL')
+            _cache = ResponseCache(path,
+                                   mode=os.getenv('LLM_CACHE_MODE', 'readwrite'),
+                                   ttl=float(ttl) if ttl else None,
+                                   max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000')))
+    return _cache
+
+def set_response_cache(cache):
+    global _cache, _cache_configured
+    _cache, _cache_configured = cache, True
+    return cache
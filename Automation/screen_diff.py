@@ -0,0 +1,119 @@
+from collections import Counter
+from session_state import *
+
+
+def format_groups(groups):
+    info_string = ''
+    for key, values in groups.items():
+        info_string += f"{key} has the following group(s):"
+        for i, v in enumerate(values, 1):
+            info_string += f"{i}#.{v};"
+    return info_string
+
+
+def group_label(group):
+    # named groups are "name:[...]", the others are named by their first widget
+    if isinstance(group, str):
+        return group.split(':[', 1)[0]
+    return str(group[0]) if isinstance(group, list) and group else str(group)
+
+
+class ScreenDiffEncoder:
+    """
+    Describes each screen to the LLM as a delta against the screen described
+    in the previous turn: the groups added, removed and changed per category.
+    The full description is sent instead for the first screen, after the
+    activity or orientation changes, every full_every turns, whenever
+    request_full() was called (e.g. after the history was summarized) and
+    whenever the delta would not be shorter.
+    """
+
+    def __init__(self, full_every=8):
+        self.full_every = full_every
+        self.previous = None  # (activity, orientation, {key: [group text]})
+        self.force_full = True
+        self.deltas_since_full = 0
+        self.full = None   # full description of the latest screen
+        self.sent = None   # what was sent for it
+        self.stats = {'full': 0, 'delta': 0, 'full_chars': 0, 'sent_chars': 0}
+
+    def request_full(self):
+        self.force_full = True
+
+    def delta(self, previous, current):
+        changes = ''
+        for key in list(previous) + [key for key in current if key not in previous]:
+            old, new = previous.get(key, []), current.get(key, [])
+            removed = list((Counter(str(v) for v in old) - Counter(str(v) for v in new)).elements())
+            added = list((Counter(str(v) for v in new) - Counter(str(v) for v in old)).elements())
+            labels = {str(v): group_label(v) for v in old + new}
+            # a removed and an added group with the same name is one changed group
+            changed = []
+            for text in list(removed):
+                match = next((a for a in added if labels[a] == labels[text]), None)
+                if match is not None:
+                    changed.append(f"{text} -> {match}")
+                    removed.remove(text)
+                    added.remove(match)
+            for what, values in (('added', added), ('removed', removed), ('changed', changed)):
+                if values:
+                    changes += f"{key} {what} group(s):" + ''.join(f"{i}#.{v};" for i, v in enumerate(values, 1))
+        return changes
+
+    def encode(self, info, activity, orientation, toast, full):
+        """What to send for this screen; full is its complete description."""
+        current = {key: values for key, values in info.items() if values != [] and values != [[]]}
+        previous = self.previous
+        self.previous = (activity, orientation, current)
+        self.full = full
+        if self.force_full or previous is None or previous[:2] != (activity, orientation) \
+                or self.deltas_since_full >= self.full_every:
+            return self.send(full, False)
+
+        changes = self.delta(previous[2], current)
+        if not changes:
+            changes = 'Nothing changed since the previous screen'
+        description = f"\n*Current Screen Information (changes since the previous screen of this activity; everything else is unchanged):  #Current Activity: {activity}.  # UI Information:{changes}."
+        if toast is not None:
+            description += f"Toast message on the page: {toast}"
+        if len(description) >= len(full):
+            return self.send(full, False)
+        return self.send(description, True)
+
+    def send(self, description, is_delta):
+        self.force_full = False
+        self.deltas_since_full = self.deltas_since_full + 1 if is_delta else 0
+        self.sent = description
+        self.stats['delta' if is_delta else 'full'] += 1
+        self.stats['full_chars'] += len(self.full)
+        self.stats['sent_chars'] += len(description)
+        return description
+
+    def restore_full(self, prompt):
+        """prompt with the latest delta replaced by the full description."""
+        if self.sent is None or self.sent == self.full or self.sent not in prompt:
+            return prompt
+        self.stats['sent_chars'] += len(self.full) - len(self.sent)
+        self.stats['delta'] -= 1
+        self.stats['full'] += 1
+        self.deltas_since_full = 0
+        prompt = prompt.replace(self.sent, self.full)
+        self.sent = self.full
+        return prompt
+
+    def format_summary(self):
+        stats = self.stats
+        saved = stats['full_chars'] - stats['sent_chars']
+        percent = 100 * saved / stats['full_chars'] if stats['full_chars'] else 0
+        return (f"Screen prompts: {stats['full']} full, {stats['delta']} delta, "
+                f"{stats['sent_chars']} of {stats['full_chars']} chars sent ({percent:.0f}% saved)")
+
+
+# None when delta prompts are off
+_session_encoder = session_local()
+
+def get_screen_encoder():
+    return _session_encoder.get()
+
+def set_screen_encoder(encoder):
+    return _session_encoder.set(encoder)
@@ -0,0 +1,29 @@
+import threading
+
+
+class SessionLocal(threading.local):
+    """
+    One value per reproduction session. The device pool runs a session per
+    thread, so the value is thread-local. get() builds it with factory on
+    first use, or returns None when there is no factory and nothing was set.
+    """
+
+    # a class default, so reading an unset value never raises AttributeError
+    value = None
+
+    def __init__(self, factory=None):
+        self.factory = factory
+
+    def get(self):
+        value = self.value
+        if value is None and self.factory is not None:
+            value = self.value = self.factory()
+        return value
+
+    def set(self, value):
+        self.value = value
+        return value
+
+
+def session_local(factory=None):
+    return SessionLocal(factory)
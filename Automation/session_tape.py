@@ -0,0 +1,153 @@
+import os
+import gzip
+import json
+from lxml import etree
+from toast_collector import get_toast_collector
+from session_state import *
+
+
+class NullTape:
+    """The tape of a session that is neither recorded nor replayed."""
+    recording = False
+    replaying = False
+
+    def screen(self, device, tree):
+        pass
+
+    def response(self, model, message):
+        pass
+
+    def command(self, command, status):
+        pass
+
+    def idle(self, device, tree):
+        pass
+
+    def observe(self, name, fn):
+        return fn()
+
+
+class SessionTape(NullTape):
+    """
+    Per-step recording of a reproduction: the settled screen each prompt was
+    built from (hierarchy XML, activity, orientation, toast), the LLM
+    response, every command with its status and the screen it left behind,
+    and other observations such as crash checks. In replay mode the same
+    hooks drive a FakeDevice (fake_device.py) through the recorded screens
+    and report where the new run diverges from the recording.
+    """
+
+    def __init__(self, mode='record', data=None, meta=None):
+        self.mode = mode
+        self.data = data or {'version': 1, 'meta': meta or {}, 'steps': [], 'result': None}
+        self.device = None  # the FakeDevice being driven, when replaying
+        self.step_index = -1
+        self.command_index = 0
+        self.divergences = []
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    @property
+    def steps(self):
+        return self.data['steps']
+
+    @classmethod
+    def load(cls, path, mode='replay'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return cls(mode, json.load(f))
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(self.data, f)
+        return path
+
+    def capture(self, device, tree):
+        app = device.app_current()
+        collector = get_toast_collector(device)
+        return {
+            'xml': etree.tostring(tree, encoding='unicode'),
+            'package': app['package'],
+            'activity': app['activity'],
+            'orientation': device.orientation,
+            'toast': collector.get_message() if collector is not None else None,
+        }
+
+    def diverge(self, what, expected, actual):
+        self.divergences.append({'step': self.step_index, 'command': self.command_index,
+                                 'what': what, 'expected': expected, 'actual': actual})
+
+    def screen(self, device, tree):
+        if self.recording:
+            self.steps.append({'screen': self.capture(device, tree), 'response': None, 'commands': []})
+            return
+        self.step_index += 1
+        self.command_index = 0
+        if self.step_index < len(self.steps):
+            expected = self.steps[self.step_index]['screen']['xml']
+            actual = etree.tostring(tree, encoding='unicode')
+            if actual != expected:
+                self.diverge('screen', len(expected), len(actual))
+
+    def response(self, model, message):
+        if self.recording and self.steps:
+            self.steps[-1]['response'] = message
+            self.steps[-1]['model'] = model
+
+    def recorded_response(self):
+        if 0 <= self.step_index < len(self.steps):
+            return self.steps[self.step_index]['response']
+        return None
+
+    def command(self, command, status):
+        if self.recording:
+            if self.steps:
+                self.steps[-1]['commands'].append({'command': command, 'status': status, 'screen_after': None})
+            return
+        step = self.steps[self.step_index] if 0 <= self.step_index < len(self.steps) else {'commands': []}
+        recorded = step['commands'][self.command_index] if self.command_index < len(step['commands']) else None
+        if recorded is None:
+            self.diverge('command', None, command)
+        elif recorded['status'] != status:
+            self.diverge('status', recorded['status'], status)
+        # show what the device showed after this command in the recording
+        after = recorded and recorded['screen_after']
+        if after is None and self.step_index + 1 < len(self.steps):
+            after = self.steps[self.step_index + 1]['screen']
+        if after is not None and self.device is not None:
+            self.device.show(after)
+        self.command_index += 1
+
+    def idle(self, device, tree):
+        if self.recording and self.steps and self.steps[-1]['commands']:
+            self.steps[-1]['commands'][-1]['screen_after'] = self.capture(device, tree)
+
+    def observe(self, name, fn):
+        """fn() when recording (the value is kept); the recorded value when replaying."""
+        if self.replaying:
+            if 0 <= self.step_index < len(self.steps):
+                return self.steps[self.step_index].get(name)
+            return None
+        value = fn()
+        if self.steps:
+            self.steps[-1][name] = value
+        return value
+
+
+NULL_TAPE = NullTape()
+
+_session_tape = session_local()
+
+def get_session_tape():
+    return _session_tape.get() or NULL_TAPE
+
+def set_session_tape(tape):
+    return _session_tape.set(tape)
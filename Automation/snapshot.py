@@ -0,0 +1,132 @@
+from hierarchy import *
+
+
+# snapshot attribute -> uiautomator2 selector keyword, in the order
+# locate_ui_object used to query the device
+SELECTOR_KEYS = {
+    'text': 'text',
+    'content-desc': 'description',
+    'resource-id': 'resourceId',
+}
+
+
+class SpatialIndex:
+    """
+    Uniform grid over node bounds. Every node is registered in the cells its
+    rectangle overlaps, so a point or exact-bounds query only inspects the
+    handful of nodes sharing one cell instead of the whole screen.
+    """
+
+    def __init__(self, elements, cell_size=200):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        for order, element in enumerate(elements):
+            rect = parse_bounds(element.attrib.get('bounds', ''))
+            if rect is None:
+                continue
+            left, top, right, bottom = rect
+            for cx in range(left // cell_size, max(left, right - 1) // cell_size + 1):
+                for cy in range(top // cell_size, max(top, bottom - 1) // cell_size + 1):
+                    self.cells[(cx, cy)].append((rect, order, element))
+
+    def _candidates(self, x, y):
+        return self.cells.get((x // self.cell_size, y // self.cell_size), [])
+
+    def _innermost_first(self, entries):
+        # smallest area first; among equal areas the later (deeper, drawn on top) node wins
+        entries.sort(key=lambda entry: ((entry[0][2] - entry[0][0]) * (entry[0][3] - entry[0][1]), -entry[1]))
+        return [element for rect, order, element in entries]
+
+    def hit(self, x, y):
+        """Nodes whose bounds contain the point, innermost first."""
+        return self._innermost_first([entry for entry in self._candidates(x, y)
+                                      if entry[0][0] <= x < entry[0][2] and entry[0][1] <= y < entry[0][3]])
+
+    def with_bounds(self, rect):
+        """Nodes whose bounds are exactly rect, in document order."""
+        entries = [entry for entry in self._candidates(rect[0], rect[1]) if entry[0] == rect]
+        entries.sort(key=lambda entry: entry[1])
+        return [element for rect, order, element in entries]
+
+
+class ScreenSnapshot:
+    """
+    The parsed hierarchy the current prompt was built from. Commands are
+    resolved against it locally instead of querying the device, until an
+    executed action marks it stale. The screen can also change while the
+    LLM is answering, so callers treat a miss as "ask the device", never as
+    "not on screen".
+    """
+
+    def __init__(self, tree, attribute_to_element_map=None):
+        self.tree = tree
+        self.attribute_to_element_map = attribute_to_element_map
+        self.stale = False
+        self._fingerprint = None
+        self._attr_index = None
+        self._spatial_index = None
+
+    @property
+    def fingerprint(self):
+        # only the event log needs it; hashed on first use
+        if self._fingerprint is None:
+            self._fingerprint = hierarchy_fingerprint(self.tree)
+        return self._fingerprint
+
+    def attr_index(self):
+        # attribute -> value -> [elements in document order], built on first use
+        if self._attr_index is None:
+            index = {key: defaultdict(list) for key in SELECTOR_KEYS}
+            for element in self.tree.iter('node'):
+                attrib = element.attrib
+                for key, values in index.items():
+                    value = attrib.get(key, '')
+                    if value:
+                        values[value].append(element)
+            self._attr_index = index
+        return self._attr_index
+
+    def spatial_index(self):
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.tree.iter('node'))
+        return self._spatial_index
+
+    def element_at(self, x, y):
+        """Innermost node under the point; FakeDevice uses it to tell which field a tap focuses."""
+        elements = self.spatial_index().hit(x, y)
+        return elements[0] if elements else None
+
+    def find_bounds(self, bounds, type=None):
+        """
+        The first node with exactly these bounds, as the device lookup it
+        replaces required. For set_text only EditText nodes qualify.
+        """
+        rect = parse_bounds(bounds)
+        if rect is None:
+            return None
+        for element in self.spatial_index().with_bounds(rect):
+            if type == 'set_text' and 'EditText' not in element.attrib.get('class', ''):
+                continue
+            return element
+        return None
+
+    def find(self, rep_attr, type=None, index=0):
+        """
+        Returns (attribute, element) for the node rep_attr refers to, trying
+        text, content-desc, resource-id and then bounds like the live selectors.
+        (None, None) if nothing on the snapshot matches.
+        """
+        attr_index = self.attr_index()
+        for key in SELECTOR_KEYS:
+            elements = attr_index[key].get(rep_attr, [])
+            if index < len(elements):
+                return key, elements[index]
+
+        element = self.find_bounds(rep_attr, type)
+        if element is not None:
+            return 'bounds', element
+        return None, None
+
+
+def is_fresh(snapshot):
+    return snapshot is not None and not snapshot.stale
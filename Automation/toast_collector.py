@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+
+
+class ToastCollector:
+    """
+    Polls the uiautomator2 toast cache on a background thread for the whole
+    session and keeps recent messages in a timestamped buffer, so reading the
+    toast for a screen never blocks.
+    """
+
+    def __init__(self, device, poll_interval=0.25, maxlen=50):
+        self.device = device
+        self.poll_interval = poll_interval
+        self.messages = deque(maxlen=maxlen)  # (monotonic timestamp, message)
+        self.last_mark = time.monotonic()
+        self.last_read = None  # timestamp of the newest toast get_message returned
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        try:
+            self.device.clear_toast()
+        except Exception:
+            pass
+        self._thread = threading.Thread(target=self._run, name='toast-collector', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.poll()
+            self._stop_event.wait(self.poll_interval)
+
+    def poll(self):
+        try:
+            message = self.device.last_toast
+        except Exception:
+            return
+        if not message:
+            return
+        with self._lock:
+            self.messages.append((time.monotonic(), message))
+        # Clearing lets a repeated toast with the same text be recorded
+        # again, but read-and-clear is not atomic: only clear when no newer
+        # toast replaced this one meanwhile, else it is left for the next poll.
+        try:
+            if self.device.last_toast == message:
+                self.device.clear_toast()
+        except Exception:
+            pass
+
+    def mark(self):
+        """Start a new window, typically right before executing an action."""
+        self.last_mark = time.monotonic()
+
+    def consume(self):
+        """The toasts get_message returned were shown to the LLM; don't report them again."""
+        if self.last_read is not None:
+            self.last_mark = max(self.last_mark, self.last_read + 1e-6)
+
+    def messages_since(self, since):
+        with self._lock:
+            return [(timestamp, message) for timestamp, message in self.messages if timestamp >= since]
+
+    def get_message(self):
+        """All toasts shown since the last mark, or None."""
+        messages = self.messages_since(self.last_mark)
+        if not messages:
+            return None
+        self.last_read = messages[-1][0]
+        return '; '.join(message for _, message in messages)
+
+
+_collectors = {}
+
+def start_toast_collector(device, **kwargs):
+    collector = _collectors.get(device.serial)
+    if collector is None:
+        collector = _collectors[device.serial] = ToastCollector(device, **kwargs).start()
+    return collector
+
+def get_toast_collector(device):
+    return _collectors.get(device.serial)
+
+def stop_toast_collector(device):
+    collector = _collectors.pop(device.serial, None)
+    if collector is not None:
+        collector.stop()
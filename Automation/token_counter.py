@@ -0,0 +1,129 @@
+import math
+import threading
+from session_state import *
+
+
+class HeuristicTokenizer:
+    # Approximate token count for Gemini (roughly 1 token per 4 characters)
+    name = 'heuristic'
+
+    def count(self, text):
+        return len(text) // 4
+
+    def truncate(self, text, n):
+        return text[:math.floor(n * 4)]
+
+
+class TiktokenTokenizer:
+    """
+    BPE counts from tiktoken (cl100k_base by default). Gemini's tokenizer is
+    not public, so these are an approximation too, just a closer one than
+    characters / 4. The BPE file is downloaded on first use unless it is in
+    tiktoken's cache; that download is abandoned after load_timeout seconds.
+    """
+
+    def __init__(self, encoding_name='cl100k_base', load_timeout=10):
+        import tiktoken
+        self.name = f'tiktoken:{encoding_name}'
+        loaded = {}
+
+        def load():
+            try:
+                loaded['encoding'] = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                loaded['error'] = e
+        # tiktoken's download has no timeout of its own
+        thread = threading.Thread(target=load, name='tiktoken-load', daemon=True)
+        thread.start()
+        thread.join(load_timeout)
+        if 'error' in loaded:
+            raise loaded['error']
+        if 'encoding' not in loaded:
+            raise TimeoutError(f"loading {encoding_name} took more than {load_timeout}s")
+        self.encoding = loaded['encoding']
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, n):
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:math.floor(n)])
+
+
+_tokenizer = None
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            _tokenizer = TiktokenTokenizer()
+        except Exception as e:
+            # tiktoken missing, or its BPE file cannot be fetched in time
+            print(f"tiktoken unavailable ({e}), falling back to characters / 4")
+            _tokenizer = HeuristicTokenizer()
+    return _tokenizer
+
+def set_tokenizer(tokenizer):
+    global _tokenizer
+    _tokenizer = tokenizer
+    return tokenizer
+
+def count_tokens(message):
+    return get_tokenizer().count(message)
+
+def truncate_message(message, n):
+    if count_tokens(message) <= n:
+        return False, None
+    else:
+        return True, get_tokenizer().truncate(message, n)
+
+
+class HistoryTokenCounter:
+    """
+    Running token total for a chat history. Each message is counted once,
+    when it is first seen; later calls only count what was appended since.
+    """
+
+    def __init__(self):
+        self.history = None
+        self.messages = []
+        self.counts = []
+        self.total = 0
+
+    def reset(self, history):
+        self.history = history
+        self.messages = []
+        self.counts = []
+        self.total = 0
+
+    def message_tokens(self, message):
+        return count_tokens(message['content']) + count_tokens(message['role'])
+
+    def sync(self, history):
+        synced = len(self.messages)
+        # the list was replaced or rewritten behind our back: recount it
+        if history is not self.history or len(history) < synced \
+                or (synced and history[synced - 1] is not self.messages[-1]):
+            self.reset(history)
+        for message in history[len(self.messages):]:
+            tokens = self.message_tokens(message)
+            self.messages.append(message)
+            self.counts.append(tokens)
+            self.total += tokens
+        return self.total
+
+    def pop(self, history):
+        """Remove the last message from history while keeping the total."""
+        self.sync(history)
+        message = history.pop()
+        self.messages.pop()
+        self.total -= self.counts.pop()
+        return message
+
+
+_session_counter = session_local(HistoryTokenCounter)
+
+def get_token_counter():
+    return _session_counter.get()
+
+def count_chat_history_tokens(chat_history):
+    return get_token_counter().sync(chat_history)
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import functools
+import threading
+from collections import defaultdict
+from session_state import *
+
+
+class _NullSpan:
+    def start(self):
+        return self
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.begin = None
+        self.child_time = 0.0
+
+    def start(self):
+        self.begin = time.perf_counter()
+        self.tracer._stack.append(self)
+        return self
+
+    def finish(self):
+        if self.begin is None:
+            return
+        duration = time.perf_counter() - self.begin
+        stack = self.tracer._stack
+        if self in stack:
+            stack.remove(self)
+        if stack:
+            stack[-1].child_time += duration
+        self.tracer.add(self.name, self.cat, self.begin, duration, duration - self.child_time, self.args)
+        self.begin = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.finish()
+        return False
+
+
+class Tracer:
+    """
+    Spans for one reproduction session, kept as Chrome Trace Event 'X'
+    events so a run opens directly in chrome://tracing or Perfetto. Each span
+    also records its self time (minus nested spans), which is what the
+    per-phase summary adds up. A disabled tracer hands out a shared no-op span.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = []
+        self.step = None
+        self._stack = []
+        self._tid = threading.get_ident()
+
+    def for_thread(self):
+        """A tracer for a helper thread, called on it: the same trace, its own span stack and tid."""
+        tracer = Tracer(self.enabled)
+        tracer.origin, tracer.events, tracer.step = self.origin, self.events, self.step
+        return tracer
+
+    def span(self, name, cat, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def add(self, name, cat, begin, duration, self_time, args):
+        args = dict(args)
+        if self.step is not None:
+            args.setdefault('step', self.step)
+        args['self_ms'] = round(self_time * 1000, 3)
+        self.events.append({
+            'name': name, 'cat': cat, 'ph': 'X',
+            'ts': round((begin - self.origin) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(), 'tid': self._tid,
+            'args': args,
+        })
+
+    def export_chrome_trace(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+def summarize_trace(events):
+    """
+    (phases, steps): self seconds and span counts per category, and self
+    seconds per category within each reproduction step.
+    """
+    phases = defaultdict(lambda: [0, 0.0])
+    steps = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        seconds = event['args'].get('self_ms', event['dur'] / 1000) / 1000
+        phases[event['cat']][0] += 1
+        phases[event['cat']][1] += seconds
+        step = event['args'].get('step')
+        if step is not None:
+            steps[step][event['cat']] += seconds
+    return phases, steps
+
+
+def format_trace_summary(events):
+    phases, steps = summarize_trace(events)
+    total = sum(seconds for count, seconds in phases.values()) or 1.0
+    lines = [f"{'Phase':<12} {'Spans':>6} {'Seconds':>9} {'Share':>7}"]
+    for cat, (count, seconds) in sorted(phases.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{cat:<12} {count:>6} {seconds:>9.2f} {seconds / total:>7.1%}")
+    cats = sorted(phases, key=lambda cat: -phases[cat][1])
+    if steps:
+        lines.append('')
+        lines.append(f"{'Step':>4} " + ' '.join(f"{cat:>9}" for cat in cats))
+        for step in sorted(steps):
+            lines.append(f"{step:>4} " + ' '.join(f"{steps[step].get(cat, 0.0):>9.2f}" for cat in cats))
+    return '\n'.join(lines)
+
+
+def load_chrome_trace(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data['traceEvents'] if isinstance(data, dict) else data
+
+
+# disabled unless a session sets one
+_session_tracer = session_local()
+_DISABLED = Tracer(enabled=False)
+
+def get_tracer():
+    return _session_tracer.value or _DISABLED
+
+def set_tracer(tracer):
+    return _session_tracer.set(tracer)
+
+def traced(cat, name=None):
+    """Record every call of the decorated function as a span of category cat."""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _session_tracer.value
+            if tracer is None or not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(tracer, label, cat, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("Usage: python3 tracing.py <trace.json>")
+        sys.exit(1)
+    print(format_trace_summary(load_chrome_trace(sys.argv[1])))
@@ -8,7 +8,9 @@ import pandas as pd
 from openpyxl import load_workbook
 import subprocess
 import base64
+from tracing import *
 
+@traced('adb')
 def clear_logcat(device_port):
     adb_command = ['adb', '-s', f'emulator-{device_port}', 'logcat', '-c']
     subprocess.run(adb_command)
@@ -20,6 +22,7 @@ def encode_image(image_path):
 
 
 
+@traced('adb')
 def get_logcat(device_port):
     #start_time = start_time.strftime('%m-%d %H:%M:%S.%f')[:-3]
     adb_command = ['adb', '-s', f'emulator-{device_port}', 'logcat', '-d', '*:E']
@@ -45,7 +48,7 @@ def load_training_prompts(path):
     with open(path, 'r') as f:
         return json.load(f)
     
-def convert_message_to_command_list(message):
+def convert_message_to_command_list(message, verbose=True):
 
     try: 
         if "[" in message and "]" in message:
@@ -71,9 +74,223 @@ def convert_message_to_command_list(message):
             command_list = []
         return command_list
     except (ValueError, SyntaxError) as e:
-        print(f"Unable to convert message to command list: {str(e)}")
+        if verbose:
+            print(f"Unable to convert message to command list: {str(e)}")
         return []
 
+def literal_or_json(text):
+    """The Python literal or JSON value text holds, or None."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+
+def normalize_command_list(value):
+    if isinstance(value, dict) and isinstance(value.get('commands'), list):
+        value = value['commands']
+    if isinstance(value, dict):
+        return [value] if value else []
+    if isinstance(value, list) and value and isinstance(value[0], list):
+        return value[0]
+    return value
+
+SMART_QUOTES = str.maketrans({'\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"'})
+JSON_CONSTANTS = {'true': 'True', 'false': 'False', 'null': 'None'}
+
+def close_brackets(text):
+    """text with an unterminated string and any unclosed brackets closed."""
+    stack, quote, escaped = [], None, False
+    for c in text:
+        if quote:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '[{':
+            stack.append(']' if c == '[' else '}')
+        elif c in ']}' and stack and stack[-1] == c:
+            stack.pop()
+    return text + (quote or '') + ''.join(reversed(stack))
+
+VALUE_END = ',:}]'
+
+def requote_single_quoted(text):
+    """
+    text with apostrophes inside single-quoted strings escaped. In a
+    single-quoted string a ' only closes it when the next non-space
+    character ends a value (, : } or ]) or the text ends there.
+    """
+    out, quote, escaped = [], None, False
+    for i, c in enumerate(text):
+        if quote == "'" and c == "'" and not escaped:
+            rest = text[i + 1:].lstrip()
+            if rest and rest[0] not in VALUE_END:
+                out.append("\\'")
+                continue
+        out.append(c)
+        if quote:
+            if escaped:
+                escaped = False
+            elif c == '\\':
+                escaped = True
+            elif c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+    return ''.join(out)
+
+def repair_command_text(message):
+    """Fix the usual near misses: code fences, smart quotes, JSON constants, missing or trailing commas, apostrophes in single-quoted values, a cut-off end."""
+    text = re.sub(r'```(?:json|python)?', '', message).translate(SMART_QUOTES)
+    starts = [i for i in (text.find('['), text.find('{')) if i >= 0]
+    if not starts:
+        return None
+    text = text[min(starts):]
+    text = re.sub(r'\b(true|false|null)\b', lambda m: JSON_CONSTANTS[m.group(1)], text)
+    text = re.sub(r'}\s*{', '}, {', text)
+    text = re.sub(r',\s*([\]}])', r'\1', text)
+    text = requote_single_quoted(text)
+    return close_brackets(text.rstrip().rstrip(','))
+
+def is_empty_response(message):
+    """The response holds no commands on purpose: no brackets at all, or [], [{}] or {}."""
+    if '[' in message and ']' in message:
+        return message[message.index('['):message.rindex(']') + 1] in ('[]', '[{}]')
+    if '{' in message and '}' in message:
+        return message[message.index('{'):message.rindex('}') + 1] == '{}'
+    # a cut-off list is a near miss, not an empty answer
+    return '[' not in message and '{' not in message
+
+def parse_command_list(message):
+    """
+    Tolerant convert_message_to_command_list. Returns (command_list, method,
+    saved): method is how the list was found - 'json', 'literal' (the
+    original parser), 'scan' (the first valid list among prose and stray
+    brackets), 'repair' (after repair_command_text), 'empty' (no commands
+    on purpose) or 'failed'; saved is True when the original parser would
+    have failed and cost a re-prompt.
+
+    >>> parse_command_list("[{'action': 'click', 'feature': 'Don't save'}]")
+    ([{'action': 'click', 'feature': "Don't save"}], 'repair', True)
+    >>> parse_command_list('[{"action": "click", "feature": "OK"} {"action": "back"}]')
+    ([{'action': 'click', 'feature': 'OK'}, {'action': 'back'}], 'repair', True)
+    >>> parse_command_list("Tap [Settings] then [{'action': 'back'}]")
+    ([{'action': 'back'}], 'scan', True)
+    """
+    legacy = convert_message_to_command_list(message, verbose=False)
+    stripped = message.strip()
+    if stripped.startswith('```'):
+        stripped = re.sub(r'^```\w*|```$', '', stripped).strip()
+    value = normalize_command_list(literal_or_json(stripped)) if stripped[:1] in '[{' else None
+    if is_command_list(value):
+        return value, 'json', not is_command_list(legacy)
+    if is_command_list(legacy):
+        return legacy, 'literal', False
+    if is_empty_response(message):
+        return [], 'empty', False
+
+    scanner = CommandListScanner()
+    command_list = scanner.feed(message)
+    repaired = repair_command_text(message)
+    repaired = CommandListScanner().feed(repaired) if repaired is not None else None
+    # a missing comma makes the scan stop at the first command; the repair keeps them all
+    if repaired is not None and (command_list is None or len(repaired) > len(command_list)):
+        return repaired, 'repair', True
+    if command_list is not None:
+        return command_list, 'repair' if scanner.repaired else 'scan', True
+    print(f"Unable to convert message to command list: {message[:200]}")
+    return legacy, 'failed', False
+
+def is_command_list(value):
+    if isinstance(value, dict):
+        return 'action' in value or 'result' in value
+    if isinstance(value, list) and value:
+        if isinstance(value[0], list):
+            value = value[0]
+        return bool(value) and all(isinstance(v, dict) for v in value) and is_command_list(value[0])
+    return False
+
+class CommandListScanner:
+    """
+    Finds the first complete command list (or result/action dict) in a
+    streamed response as the text arrives. Brackets inside quoted strings
+    are ignored; a balanced candidate that does not parse to commands
+    (e.g. "[Settings]" in prose) is skipped, and so is one whose quote is
+    still open at a newline or at the next "[{" or "{'". A candidate that
+    only parses after repair_command_text is taken repaired, so a list
+    with a missing comma is not cut down to its first command. Empty lists
+    are left to parse_command_list on the full text.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.start = None
+        self.stack = []
+        self.quote = None
+        self.escaped = False
+        self.command_list = None
+        self.repaired = False
+
+    def feed(self, text):
+        """text is everything received so far; returns the command list once complete."""
+        self.text = text
+        while self.command_list is None and self.pos < len(text):
+            c = text[self.pos]
+            self.pos += 1
+            if self.start is None:
+                if c in '[{':
+                    self.start, self.stack = self.pos - 1, [c]
+                continue
+            if self.quote:
+                if self.escaped:
+                    self.escaped = False
+                elif c == '\\':
+                    self.escaped = True
+                elif c == self.quote:
+                    self.quote = None
+                elif c in '[{' and self.pos == len(text):
+                    # need the next character to tell whether a list starts here
+                    self.pos -= 1
+                    break
+                elif c == '\n' or text.startswith(("[{", "{'", '{"'), self.pos - 1):
+                    # an apostrophe in prose ("the user's list"), not a string:
+                    # give up this candidate and start over here
+                    self.pos, self.start, self.stack, self.quote, self.escaped = self.pos - 1, None, [], None, False
+            elif c in '\'"':
+                self.quote = c
+            elif c in '[{':
+                self.stack.append(c)
+            elif c in ']}':
+                if self.stack.pop() != ('[' if c == ']' else '{') or not self.stack:
+                    self.candidate(self.start, self.pos)
+        return self.command_list
+
+    def candidate(self, start, end):
+        text = self.text[start:end]
+        value = literal_or_json(text)
+        if not is_command_list(value):
+            repaired = repair_command_text(text)
+            value = literal_or_json(repaired) if repaired is not None else None
+            self.repaired = is_command_list(value)
+        if is_command_list(value):
+            if isinstance(value, dict):
+                value = [value]
+            elif isinstance(value[0], list):
+                value = value[0]
+            self.command_list = value
+        else:
+            # rescan from just after the bracket that opened this candidate
+            self.pos, self.start, self.stack, self.quote, self.escaped = start + 1, None, [], None, False
+
 def add_commands(commands, new_commands):
     if new_commands is None:
         return None
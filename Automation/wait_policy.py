@@ -0,0 +1,111 @@
+import time
+from collections import defaultdict
+from hierarchy import *
+from event_log import *
+from session_state import *
+
+
+DEFAULT_CEILINGS = {
+    'app_stop': 2.0,
+    'app_start': 5.0,
+    'command': 1.0,
+    'suggestion': 3.0,
+    'check_crash': 1.5,
+    'restart': 2.0,
+    'settle': 2.0,
+}
+
+
+class WaitPolicy:
+    """
+    Replaces fixed sleeps with waits on real signals (package change,
+    a settled hierarchy). Every wait is bounded by a configurable ceiling and
+    its actual duration is recorded.
+    """
+
+    def __init__(self, ceilings=None, poll_interval=0.1, max_interval=0.5, long_press_duration=1.5):
+        self.ceilings = dict(DEFAULT_CEILINGS)
+        if ceilings:
+            self.ceilings.update(ceilings)
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.long_press_duration = long_press_duration
+        self.last_settled = None  # fingerprint of the latest settled screen
+        self.records = []  # (name, seconds waited, condition met)
+
+    def record(self, name, seconds, satisfied):
+        self.records.append((name, seconds, satisfied))
+        get_event_log().emit('wait', seconds, name=name, satisfied=satisfied)
+
+    @traced('wait')
+    def wait_until(self, name, condition, ceiling=None):
+        if ceiling is None:
+            ceiling = self.ceilings.get(name, 1.0)
+        start = time.monotonic()
+        deadline = start + ceiling
+        interval = self.poll_interval
+        while True:
+            try:
+                satisfied = bool(condition())
+            except Exception:
+                satisfied = False
+            now = time.monotonic()
+            if satisfied or now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, self.max_interval)
+        self.record(name, time.monotonic() - start, satisfied)
+        return satisfied
+
+    def wait_for_app_stopped(self, device, package_name, ceiling=None):
+        return self.wait_until('app_stop', lambda: device.app_current()['package'] != package_name, ceiling)
+
+    def wait_for_app_foreground(self, device, package_name, ceiling=None):
+        return self.wait_until('app_start', lambda: device.app_current()['package'] == package_name, ceiling)
+
+    @traced('wait')
+    def settle(self, device, name='settle', ceiling=None):
+        """wait_for_stable_screen under this policy; returns (tree, transient_tree)."""
+        if ceiling is None:
+            ceiling = self.ceilings.get(name, 1.0)
+        start = time.monotonic()
+        tree, transient_tree = wait_for_stable_screen(device, timeout=ceiling, interval=self.poll_interval,
+                                                      max_interval=self.max_interval, previous_fingerprint=self.last_settled)
+        seconds = time.monotonic() - start
+        self.last_settled = hierarchy_fingerprint(tree)
+        self.record(name, seconds, seconds < ceiling)
+        return tree, transient_tree
+
+    def wait_for_idle(self, device, name='command', ceiling=None):
+        """Wait until the hierarchy stops changing; returns the settled tree."""
+        return self.settle(device, name, ceiling)[0]
+
+    @traced('sleep')
+    def sleep(self, name, seconds):
+        # explicit waits requested by the model are still honoured
+        time.sleep(seconds)
+        self.record(name, seconds, True)
+
+    def summary(self):
+        totals = defaultdict(lambda: [0, 0.0, 0])
+        for name, seconds, satisfied in self.records:
+            totals[name][0] += 1
+            totals[name][1] += seconds
+            totals[name][2] += 0 if satisfied else 1
+        return {name: {'count': count, 'seconds': seconds, 'timeouts': timeouts}
+                for name, (count, seconds, timeouts) in totals.items()}
+
+    def format_summary(self):
+        lines = [f"{'Wait':<14} {'Count':>6} {'Seconds':>9} {'Timeouts':>9}"]
+        for name, stats in sorted(self.summary().items()):
+            lines.append(f"{name:<14} {stats['count']:>6} {stats['seconds']:>9.2f} {stats['timeouts']:>9}")
+        return '\n'.join(lines)
+
+
+_session_policy = session_local(WaitPolicy)
+
+def get_wait_policy():
+    return _session_policy.get()
+
+def set_wait_policy(policy):
+    return _session_policy.set(policy)
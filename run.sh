@@ -11,85 +11,34 @@ echo "[1/5] Starting ADB server..."
 $ADB start-server 2>&1 | grep -v "daemon started successfully" || true
 sleep 1
 
-# Check for running devices
-echo "[2/5] Checking for devices..."
-DEVICE_COUNT=$($ADB devices | grep -v "List of devices" | grep -E "device$|emulator" | wc -l | xargs)
-
-if [ "$DEVICE_COUNT" -eq 0 ]; then
-    echo "No running devices found."
-    echo ""
-    echo "Available emulators:"
-    AVDS=$($EMULATOR -list-avds)
-    
-    if [ -z "$AVDS" ]; then
-        echo "Error: No emulators available. Please create one in Android Studio."
-        exit 1
-    fi
-    
-    echo "$AVDS"
-    echo ""
-    
-    # Get first available AVD
-    FIRST_AVD=$(echo "$AVDS" | head -n 1)
-    echo "Starting emulator: $FIRST_AVD"
-    
-    # Start emulator in background
-    $EMULATOR -avd "$FIRST_AVD" -no-snapshot-load > /dev/null 2>&1 &
-    EMULATOR_PID=$!
-    
-    echo "Waiting for emulator to boot (30-60 seconds)..."
-    
-    # Wait for device to appear
-    MAX_WAIT=120
-    WAITED=0
-    while [ $WAITED -lt $MAX_WAIT ]; do
-        DEVICE_COUNT=$($ADB devices | grep -v "List of devices" | grep -E "device$|emulator" | wc -l | xargs)
-        if [ "$DEVICE_COUNT" -gt 0 ]; then
-            break
-        fi
-        sleep 3
-        WAITED=$((WAITED + 3))
-        echo -n "."
-    done
-    echo ""
-    
-    if [ "$DEVICE_COUNT" -eq 0 ]; then
-        echo "Error: Timeout waiting for emulator"
-        exit 1
-    fi
+# Boot the emulator pool from quick-boot snapshots, or reuse the emulators
+# still running from the last batch
+POOL_SIZE="${POOL_SIZE:-1}"
+# RESET=auto|clear|snapshot|reinstall resets app state before each batch test.
+# Per-APK snapshots only persist on writable emulators (one AVD each), so
+# RESET=snapshot, or SNAPSHOTS=1 with RESET=auto, boots the pool writable.
+RESET="${RESET:-none}"
+TEST_ARGS="--reset $RESET"
+if [ "$RESET" = "snapshot" ] || [ "${SNAPSHOTS:-0}" = "1" ]; then
+    POOL_ARGS="$POOL_ARGS --writable"
+    TEST_ARGS="$TEST_ARGS --snapshots"
 fi
+echo "[2/5] Preparing $POOL_SIZE emulator(s)..."
+DEVICE_PORTS=$(ANDROID_SDK_ROOT="$ANDROID_SDK" python3 "$(dirname "$0")/Automation/emulator_pool.py" up "$POOL_SIZE" $POOL_ARGS)
 
-# Get device serial
-DEVICE_SERIAL=$($ADB devices | grep -v "List of devices" | grep -E "device$|emulator" | head -n 1 | awk '{print $1}')
-echo "Device found: $DEVICE_SERIAL"
-
-# Extract port number
-DEVICE_PORT=$(echo "$DEVICE_SERIAL" | sed 's/emulator-//')
-
-echo "[3/5] Waiting for device to be ready..."
-$ADB -s "$DEVICE_SERIAL" wait-for-device
-
-# Wait for boot to complete
-MAX_BOOT_WAIT=60
-BOOT_WAITED=0
-while [ $BOOT_WAITED -lt $MAX_BOOT_WAIT ]; do
-    BOOT_STATUS=$($ADB -s "$DEVICE_SERIAL" shell getprop sys.boot_completed 2>/dev/null | tr -d '\r')
-    if [ "$BOOT_STATUS" = "1" ]; then
-        break
-    fi
-    sleep 2
-    BOOT_WAITED=$((BOOT_WAITED + 2))
-done
-
-if [ "$BOOT_STATUS" != "1" ]; then
-    echo "Warning: Device may not be fully booted"
+if [ -z "$DEVICE_PORTS" ]; then
+    echo "Error: No emulator could be booted"
+    exit 1
 fi
 
-echo "Device is ready (port: $DEVICE_PORT)"
+DEVICE_PORT=$(echo "$DEVICE_PORTS" | awk '{print $1}')
+echo "Device(s) ready (ports: $DEVICE_PORTS)"
 
 # Wait for package manager
-sleep 2
-$ADB -s "$DEVICE_SERIAL" shell pm list packages > /dev/null 2>&1
+echo "[3/5] Waiting for package manager..."
+for PORT in $DEVICE_PORTS; do
+    $ADB -s "emulator-$PORT" shell pm list packages > /dev/null 2>&1
+done
 
 echo "[4/5] Activating Python environment..."
 cd "$(dirname "$0")/Automation"
@@ -99,4 +48,9 @@ source ../env/bin/activate
 # $ADB -s "$DEVICE_SERIAL" install -t -r APKs/wordpress/wpandroid-15.9-rc-1-universal.apk
 
 
-python3 reproduction.py "$DEVICE_PORT" BRs/NewPipe_v0.20.11.txt
+if [ "$1" = "batch" ]; then
+    # every warm emulator takes tests from the APK/BR mapping
+    python3 incremental_test.py --headless $TEST_ARGS $DEVICE_PORTS
+else
+    python3 reproduction.py "$DEVICE_PORT" BRs/NewPipe_v0.20.11.txt
+fi